@@ -1,12 +1,31 @@
+import codecs
+import hashlib
+import io
+import json
+import mmap
+import random
 import re
 import requests
+import struct
+import sys
+import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
-from datetime import date
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
+from functools import lru_cache, wraps
+from heapq import nsmallest
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import accumulate, chain
 from multi_key_dict import multi_key_dict
 from mycroft import MycroftSkill, intent_handler
-from os import listdir, mkdir, remove
-from os.path import join, exists
+from os import listdir, makedirs, mkdir, remove, replace
+from os.path import dirname, join, exists
 
 # change this variable to set a Skill name that does not sound strange in your used language:
 SKILL_NAME='FH-SWF Raumbelegung'
@@ -29,6 +48,114 @@ fhswfLocationMap['soest', 'so', 'lübecker ring', 'luebecker ring', 'campus soes
 
 fhswfLocationVpisShortKey = {'Iserlohn': 'Is', 'Hagen': 'Ha', 'Lüdenscheid': 'Ls', 'Meschede': 'Me', 'Soest': 'So' } #, 'Hagen IAH': 'Z'}
 
+# precompiled steps of normalizeCourseString and stripRoomLocationPrefix, see there
+courseRemovedCharacters = str.maketrans('', '', '():,')
+courseDashPattern = re.compile(r'\s+- ')
+courseUndCharacters = str.maketrans({'/': ' und ', '&': ' und '})
+courseSpacesPattern = re.compile(r'\s+')
+roomLocationPrefixPattern = re.compile(r'[A-Za-z]{2}-(.*)')
+
+# maximum number of memoized normalized course names and room numbers
+NORMALIZE_CACHE_SIZE = 16384
+
+# spoken days (see day.entity) relative to today and weekdays as used by date.weekday()
+relativeDays = {'heute': 0, 'morgen': 1, 'übermorgen': 2, 'uebermorgen': 2, 'gestern': -1}
+weekdays = {'montag': 0, 'dienstag': 1, 'mittwoch': 2, 'donnerstag': 3, 'freitag': 4, 'samstag': 5, 'sonntag': 6}
+months = {'januar': 1, 'februar': 2, 'märz': 3, 'maerz': 3, 'april': 4, 'mai': 5, 'juni': 6,
+          'juli': 7, 'august': 8, 'september': 9, 'oktober': 10, 'november': 11, 'dezember': 12}
+
+# spoken digits, numbers and letter names as recognized by STT, used to normalize spoken room numbers
+spokenRoomTokens = {'null': '0', 'eins': '1', 'ein': '1', 'eine': '1', 'zwei': '2', 'zwo': '2', 'drei': '3', 'vier': '4',
+                    'fünf': '5', 'fuenf': '5', 'sechs': '6', 'sieben': '7', 'acht': '8', 'neun': '9', 'zehn': '10',
+                    'elf': '11', 'zwölf': '12', 'zwoelf': '12', 'dreizehn': '13', 'vierzehn': '14', 'fünfzehn': '15',
+                    'fuenfzehn': '15', 'sechzehn': '16', 'siebzehn': '17', 'achtzehn': '18', 'neunzehn': '19', 'zwanzig': '20',
+                    'punkt': '.', 'strich': '-', 'minus': '-',
+                    'be': 'b', 'ce': 'c', 'zeh': 'c', 'de': 'd', 'ef': 'f', 'ge': 'g', 'ha': 'h', 'ka': 'k', 'el': 'l',
+                    'em': 'm', 'en': 'n', 'pe': 'p', 'er': 'r', 'es': 's', 'te': 't', 'vau': 'v', 'we': 'w', 'ix': 'x', 'zett': 'z'}
+
+# spoken numbers of course names (eg. "mathematik eins"), "ein" and "eine" are too common inside course names
+spokenCourseNumbers = {token: value for token, value in spokenRoomTokens.items() if value.isdigit() and token not in ('ein', 'eine')}
+
+# minimum similarity (0..1) of a spoken room or course to be accepted as match and maximum number of
+# equally well matching names the user is asked to choose from
+FUZZY_MATCH_MIN_SCORE = 0.5
+FUZZY_MATCH_MAX_CHOICES = 3
+
+# everything the skill writes at runtime goes into this hidden directory of the skill, because Mycroft
+# reloads a skill when any file of it changes, but ignores hidden files and directories
+SKILL_DATA_DIR = '.cache'
+
+# timetable cache defaults (seconds / number of entries), can be overridden by skill settings:
+TIMETABLE_CACHE_DIR = join(SKILL_DATA_DIR, 'timetables')
+TIMETABLE_CACHE_TTL = 15 * 60
+TIMETABLE_CACHE_STALE_TTL = 24 * 60 * 60
+TIMETABLE_CACHE_MAX_ENTRIES = 64
+
+# background prefetching of every location's semester timetable (seconds), can be overridden by skill settings.
+# Every interval all locations are fetched once, one after another, spread evenly over the interval.
+PREFETCH_INTERVAL = TIMETABLE_CACHE_TTL
+PREFETCH_NIGHT_INTERVAL = 2 * 60 * 60
+PREFETCH_NIGHT_HOURS = (22, 6)
+PREFETCH_STARTUP_DELAY = 10
+
+# free room finder: default duration (minutes) a room has to be free, time budget (seconds) to collect
+# the timetables of all locations and maximum number of rooms spoken per location
+FREE_ROOM_DEFAULT_MINUTES = 60
+FREE_ROOM_QUERY_TIMEOUT = 4
+FREE_ROOM_MAX_SPOKEN = 5
+
+# seconds an intent handler waits for VPIS before it acknowledges the query and answers as soon as the data
+# arrived, but at most QUERY_TIMEOUT seconds after the query (can be overridden by skill settings
+# 'acknowledgeDeadline' and 'queryTimeout')
+ACKNOWLEDGE_DEADLINE = 1.0
+QUERY_TIMEOUT = 15
+
+# number of upcoming occurrences spoken for "when does course x take place"
+NEXT_OCCURRENCES_SPOKEN = 3
+
+# spoken answers: slots of the same course in the same room are spoken as one, if the break between them
+# is at most SLOT_MERGE_MAX_GAP minutes. At most SPOKEN_ITEMS_PER_BATCH items are spoken before asking for more
+# (can be overridden by skill setting 'spokenItemsPerBatch').
+SLOT_MERGE_MAX_GAP = 45
+SPOKEN_ITEMS_PER_BATCH = 5
+
+# startup fetching: number of parallel requests and (connect, read) timeout in seconds per request
+VPIS_MAX_WORKERS = 8
+VPIS_REQUEST_TIMEOUT = (5, 30)
+
+# number of urls whose validators (ETag, Last-Modified, content hash) and parsed result are kept for revalidation
+VPIS_MAX_VALIDATED_URLS = 128
+
+# streamed responses are hashed while they are spooled in chunks, in memory up to VPIS_SPOOL_MAX_MEMORY bytes
+VPIS_STREAM_CHUNK_SIZE = 64 * 1024
+VPIS_SPOOL_MAX_MEMORY = 16 * 1024 * 1024
+
+# retries of failed VPIS requests (connection errors, timeouts and 5xx) with jittered exponential backoff in seconds
+VPIS_MAX_RETRIES = 3
+VPIS_RETRY_BACKOFF = 0.5
+
+# the control document and the location urls change at most once a semester:
+VPIS_LOCATION_URL_TTL = 12 * 60 * 60
+
+# instrumentation (disabled by default, see skill settings 'metrics', 'metricsLogInterval', 'metricsFile' and 'metricsPort'):
+# upper bounds of the histogram buckets for durations (seconds) and for sizes (bytes, number of slots)
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+METRICS_LOG_INTERVAL = 15 * 60
+METRICS_FILE = join(SKILL_DATA_DIR, 'metrics.json')
+
+# snapshot of every location's timetables, rooms and courses for offline answering (see writeSnapshot),
+# loaded at startup from the skill directory (can be overridden by skill setting 'snapshotFile')
+SNAPSHOT_FILE = 'snapshot.bin'
+SNAPSHOT_MAGIC = b'FHSWFSNP'
+SNAPSHOT_VERSION = 1
+# header: magic, version, reserved, createdAt, number of strings, number of sections
+SNAPSHOT_HEADER = struct.Struct('<8sIIdII')
+# section directory entry: kind, key string, semester string, number of rows, offset of the uint32 data
+SNAPSHOT_SECTION = struct.Struct('<IIIII')
+SNAPSHOT_TIMETABLE, SNAPSHOT_ROOMS, SNAPSHOT_COURSES = 1, 2, 3
+
+@lru_cache(maxsize = NORMALIZE_CACHE_SIZE)
 def normalizeCourseString(string):
     """Normalizes course names, so they match anywhere used.
 
@@ -38,6 +165,9 @@ def normalizeCourseString(string):
     4. Replaces multiple spaces with only one space because after string manipulation there might be more spaces...
     5. Returns lower case string which should contain a course name.
 
+    Every step uses a precompiled pattern or translation table and results are memoized,
+    because the same course names are normalized over and over again on every refresh.
+
     Parameters
     ----------
     string: string
@@ -49,13 +179,848 @@ def normalizeCourseString(string):
         Normalized course name string converted to lower case.
     """
 
-    string = re.sub(r'[\(\)\:,]', r'', string)
-    string = re.sub(r'([\s]+\- )', r'', string)
-    string = re.sub(r'[/&]', r' und ', string)
-    string = re.sub(r'[\s]+', r' ', string)
-    return string.lower()
+    string = string.translate(courseRemovedCharacters)
+    string = courseDashPattern.sub('', string)
+    string = string.translate(courseUndCharacters)
+    return courseSpacesPattern.sub(' ', string).lower()
+
+@lru_cache(maxsize = NORMALIZE_CACHE_SIZE)
+def stripRoomLocationPrefix(roomNumber):
+    """Removes the location prefix of a VPIS room number and converts it to lower case, eg. "Is-H409" => "h409".
+
+    Room numbers without prefix are only converted to lower case.
+    """
+
+    match = roomLocationPrefixPattern.search(roomNumber)
+    return (match.group(1) if match else roomNumber).lower()
+
+class Histogram:
+    """Counts observed values in buckets of fixed upper bounds, like a Prometheus histogram.
+
+    Parameters
+    ----------
+    buckets: tuple
+        Sorted upper bounds (inclusive) of the buckets. Larger values are counted in an overflow bucket.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimates the q-quantile (0..1) as upper bound of the bucket it falls into (max for the overflow bucket)."""
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return self.max
+
+    def toDict(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts))}
+
+class MetricsTimer:
+    """Context manager which observes its duration in the histogram name of metrics."""
+
+    __slots__ = ('metrics', 'name', 'begin')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.begin)
+
+class NoopTimer:
+    """Context manager doing nothing, returned by Metrics.timer while metrics are disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+noopTimer = NoopTimer()
+
+class Metrics:
+    """In-memory aggregation of counters and histograms of the hot paths (VPIS requests, parsing, cache, intents).
+
+    Stage durations are observed with timer(name) in METRICS_LATENCY_BUCKETS, sizes like byte and slot
+    counts with observe(name, value, METRICS_SIZE_BUCKETS). While disabled, timer returns a shared no-op
+    context manager and count/observe return immediately, so instrumented code costs a single attribute lookup.
+
+    Parameters
+    ----------
+    enabled: bool, default = False
+        Whether anything is recorded.
+    """
+
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.startedAt = time.time()
+        self._counters = Counter()
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        """Returns a context manager, which observes the duration of its block in the histogram name."""
+
+        if not self.enabled:
+            return noopTimer
+        return MetricsTimer(self, name)
+
+    def count(self, name, value = 1):
+        """Increments the counter name by value."""
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, value, buckets = METRICS_LATENCY_BUCKETS):
+        """Records value in the histogram name, which is created with buckets on its first observation."""
+
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def timed(self, name):
+        """Decorator, which observes the duration of every call of the decorated function in the histogram name."""
+
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.startedAt = time.time()
+
+    def toDict(self):
+        """Returns every counter and histogram as json serializable dictionary."""
+
+        with self._lock:
+            return {'startedAt': self.startedAt,
+                    'counters': dict(self._counters),
+                    'histograms': {name: histogram.toDict() for name, histogram in self._histograms.items()}}
+
+    def summary(self):
+        """Returns a human readable multi-line summary, one line per histogram and counter."""
+
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                if histogram.buckets is METRICS_LATENCY_BUCKETS:
+                    lines.append('{}: n={} mean={:.1f}ms p50<={:.0f}ms p95<={:.0f}ms max={:.1f}ms'.format(
+                        name, histogram.count, histogram.sum / histogram.count * 1000, histogram.quantile(0.5) * 1000,
+                        histogram.quantile(0.95) * 1000, histogram.max * 1000))
+                else:
+                    lines.append('{}: n={} mean={:.0f} max={:.0f}'.format(name, histogram.count, histogram.sum / histogram.count, histogram.max))
+            for name, value in sorted(self._counters.items()):
+                lines.append('{}: {}'.format(name, value))
+        return '\n'.join(lines)
+
+    def writeJson(self, fileName):
+        """Writes toDict() into fileName, replacing the file atomically."""
+
+        with open(fileName + '.tmp', 'w', encoding = 'utf-8') as metricsFile:
+            json.dump(self.toDict(), metricsFile, indent = 1)
+        replace(fileName + '.tmp', fileName)
+
+    def toPrometheusText(self, prefix = 'fhswf_raumbelegung_'):
+        """Returns every counter and histogram in the Prometheus text exposition format."""
+
+        def metricName(name):
+            return prefix + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                lines.append('# TYPE {0}_total counter\n{0}_total {1}'.format(metricName(name), value))
+            for name, histogram in sorted(self._histograms.items()):
+                name = metricName(name)
+                lines.append('# TYPE {} histogram'.format(name))
+                cumulative = 0
+                for bound, count in zip([str(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, cumulative))
+                lines.append('{}_sum {}\n{}_count {}'.format(name, histogram.sum, name, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class MetricsServer:
+    """Serves metrics.toPrometheusText() over HTTP on localhost from a daemon thread.
+
+    Parameters
+    ----------
+    metrics: Metrics
+        The metrics to serve.
+
+    port: int
+        Local port to listen on, every path answers with the metrics.
+    """
+
+    def __init__(self, metrics, port):
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.toPrometheusText().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class VpisClient:
+    """HTTP client for every request to VPIS.
+
+    Owns a pooled requests.Session, so connections (and TLS sessions) are kept alive and reused.
+    Every request gets additionalRequestHeaders and a (connect, read) timeout. Connection errors,
+    timeouts and 5xx responses are retried with exponential backoff and full jitter. The number of
+    requests in flight at the same time is capped by maxConcurrentRequests.
+
+    Parameters
+    ----------
+    headers: dict, default = additionalRequestHeaders
+        Headers sent with every request.
+
+    timeout: tuple, default = VPIS_REQUEST_TIMEOUT
+        (connect, read) timeout in seconds.
+
+    maxRetries: int, default = VPIS_MAX_RETRIES
+        Number of retries after the first failed attempt.
+
+    backoff: float, default = VPIS_RETRY_BACKOFF
+        Base of the backoff in seconds, the n-th retry waits up to backoff * 2^n seconds.
+
+    maxConcurrentRequests: int, default = VPIS_MAX_WORKERS
+        Maximum number of requests running at the same time, also used as connection pool size.
+    """
+
+    def __init__(self, headers = additionalRequestHeaders, timeout = VPIS_REQUEST_TIMEOUT, maxRetries = VPIS_MAX_RETRIES,
+                 backoff = VPIS_RETRY_BACKOFF, maxConcurrentRequests = VPIS_MAX_WORKERS):
+        self.timeout = timeout
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections = maxConcurrentRequests, pool_maxsize = maxConcurrentRequests)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._semaphore = threading.BoundedSemaphore(maxConcurrentRequests)
+        self._validated = OrderedDict()
+        self._validatedLock = threading.Lock()
+
+    def get(self, url, params = None, **kwargs):
+        """Sends a GET request like requests.get and returns the response.
+
+        Raises the last requests.RequestException if every attempt failed with a connection error or timeout.
+        The response of the last attempt is returned if every attempt answered with a 5xx status code.
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.maxRetries + 1):
+            if attempt:
+                metrics.count('vpis.retries')
+            try:
+                with self._semaphore, metrics.timer('vpis.request'):
+                    response = self.session.get(url, params = params, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.maxRetries:
+                    metrics.count('vpis.errors')
+                    raise
+            else:
+                if response.status_code < 500 or attempt >= self.maxRetries:
+                    return response
+                response.close()
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def getParsed(self, url, parse, params = None, stream = False, variant = None):
+        """Sends a conditional GET request and returns parse(response), reusing the previous result if unchanged.
+
+        The ETag, Last-Modified and a hash of the body of every successful (200) response are stored
+        together with the parsed result. Following requests send If-None-Match/If-Modified-Since.
+        If VPIS answers with 304 or with an identical body, the stored result is returned without parsing.
+        Results of any other status code are passed to parse, but never stored.
+
+        Parameters
+        ----------
+        url: string
+            Requested url.
+
+        parse: callable
+            Called with the response, returns the parsed result. It may raise for invalid responses.
+
+        params: dict, default = None
+            Query parameters of the request.
+
+        stream: bool, default = False
+            If set, the body is not loaded into response.content. It is hashed while it is spooled
+            (in memory up to VPIS_SPOOL_MAX_MEMORY bytes, on disk beyond) and parse has to read it
+            from the spooled file in response.raw. An unchanged body skips parsing just like a 304.
+
+        variant: any, default = None
+            Distinguishes different parse results of the same url, eg. different date ranges.
+
+        Returns
+        -------
+        result: any
+            The (possibly reused) return value of parse. Callers must not modify it.
+        """
+
+        key = (url, tuple(sorted((params or {}).items())), variant)
+        with self._validatedLock:
+            validated = self._validated.get(key)
+
+        headers = {}
+        if validated:
+            if validated['etag']:
+                headers['If-None-Match'] = validated['etag']
+            if validated['lastModified']:
+                headers['If-Modified-Since'] = validated['lastModified']
+
+        response = self.get(url, params = params, headers = headers, stream = stream)
+        spool = None
+        try:
+            if response.status_code == 304 and validated:
+                metrics.count('vpis.notModified')
+                self._storeValidated(key, validated)
+                return validated['result']
+            elif not response.status_code == 200:
+                return parse(response)
+
+            if stream:
+                # iter_content decodes the body and reads until the end of the stream (a plain read loop
+                # over response.raw may see an early empty chunk while decoding and truncate the body)
+                contentHash, contentSize = hashlib.sha1(), 0
+                spool = tempfile.SpooledTemporaryFile(max_size = VPIS_SPOOL_MAX_MEMORY)
+                for chunk in response.iter_content(VPIS_STREAM_CHUNK_SIZE):
+                    contentHash.update(chunk)
+                    contentSize += len(chunk)
+                    spool.write(chunk)
+                spool.seek(0)
+                response.raw = spool
+                contentHash = contentHash.hexdigest()
+            else:
+                contentHash, contentSize = hashlib.sha1(response.content).hexdigest(), len(response.content)
+            metrics.observe('vpis.bytes', contentSize, METRICS_SIZE_BUCKETS)
+
+            if validated and validated['hash'] == contentHash:
+                metrics.count('vpis.unchanged')
+                result = validated['result']
+            else:
+                result = parse(response)
+        finally:
+            # the consumed response does not close its raw stream any more, so the spooled file is closed here
+            response.close()
+            if spool:
+                spool.close()
+
+        self._storeValidated(key, {'etag': response.headers.get('ETag'),
+                                   'lastModified': response.headers.get('Last-Modified'),
+                                   'hash': contentHash,
+                                   'result': result})
+        return result
+
+    def _storeValidated(self, key, validated):
+        with self._validatedLock:
+            self._validated[key] = validated
+            self._validated.move_to_end(key)
+            while len(self._validated) > VPIS_MAX_VALIDATED_URLS:
+                self._validated.popitem(last = False)
+
+    def clearValidated(self):
+        """Forgets every stored validator and parsed result, so the next requests are unconditional."""
+
+        with self._validatedLock:
+            self._validated.clear()
+
+    def close(self):
+        self.session.close()
+
+vpisClient = VpisClient()
+
+def parseVpisXmlResponse(vpisResponse):
+    """Checks a VPIS response for status code 200 and XML content and returns the parsed root element."""
+
+    if not vpisResponse.status_code == 200:
+        raise RuntimeError("Connect to " + vpisResponse.url + " failed. HTTP response code: " + str(vpisResponse.status_code))
+    elif not re.search('application/xml', vpisResponse.headers['content-type']):
+        raise RuntimeError('Response is no valid XML.')
+    return ET.fromstring(vpisResponse.content)
+
+class VpisLocationResolver:
+    """Resolves and memoizes the final activity url of every location listed in the VPIS control document.
+
+    The control document (vpisapp.php) only contains short urls which redirect to the current semester's
+    activities of a location. Both hardly ever change, so the control document is fetched once and every
+    resolved url is kept until ttl expires or until invalidate() is called (eg. after a 404 response).
+
+    Parameters
+    ----------
+    controlUrl: string, default = VPIS_CONTROL_URL
+        The url to VPIS API control page.
+
+    ttl: int, default = VPIS_LOCATION_URL_TTL
+        Seconds until the control document and all resolved urls are fetched again.
+
+    client: VpisClient, default = None
+        Client used for every request, defaults to the shared vpisClient.
+    """
+
+    def __init__(self, controlUrl = VPIS_CONTROL_URL, ttl = VPIS_LOCATION_URL_TTL, client = None):
+        self.controlUrl = controlUrl
+        self.ttl = ttl
+        self.client = client or vpisClient
+        self._controlXml = None
+        self._controlFetchedAt = 0
+        self._resolvedUrls = {}
+        # _lock only guards the memoized state, requests are made under the control or per location locks,
+        # so cold requests of different locations run concurrently while each url is fetched only once
+        self._lock = threading.Lock()
+        self._controlLock = threading.Lock()
+        self._locationLocks = {}
+
+    def _controlExpired(self):
+        return self._controlXml is None or time.time() - self._controlFetchedAt >= self.ttl
+
+    def getControlXml(self, forceRefresh = False):
+        """Returns the parsed control document, fetching it only if it expired or forceRefresh is set."""
+
+        with self._lock:
+            if not forceRefresh and not self._controlExpired():
+                return self._controlXml
+            fetchedBefore = self._controlFetchedAt
+
+        with self._controlLock:
+            with self._lock:
+                # another thread fetched it while this one was waiting
+                if self._controlFetchedAt != fetchedBefore and not self._controlExpired():
+                    return self._controlXml
+            controlXml = self.client.getParsed(self.controlUrl, parseVpisXmlResponse)
+            with self._lock:
+                self._controlXml = controlXml
+                self._controlFetchedAt = time.time()
+            return controlXml
+
+    def getLocationUrls(self, forceRefresh = False):
+        """Returns a dict of every location name inside the control document and its (unresolved) href."""
+
+        return {str(locationChild.text): locationChild.get('href')
+                for locationChild in self.getControlXml(forceRefresh).findall('./locations')}
+
+    def resolve(self, location, forceRefresh = False):
+        """Returns the final activity url for location (a key of fhswfLocationMap).
+
+        The redirect behind the location href is followed once and memoized. If the href inside
+        a refreshed control document changed, the url is resolved again.
+        """
+
+        locationName = fhswfLocationMap[location]
+        href = self.getLocationUrls(forceRefresh).get(locationName)
+        if not href:
+            raise RuntimeError('VPIS does not provide a url for ' + locationName)
+
+        def isValid(resolved):
+            return resolved and resolved[0] == href and time.time() - resolved[2] < self.ttl
+
+        with self._lock:
+            resolved = self._resolvedUrls.get(locationName)
+            if not forceRefresh and isValid(resolved):
+                return resolved[1]
+            locationLock = self._locationLocks.setdefault(locationName, threading.Lock())
+
+        with locationLock:
+            with self._lock:
+                current = self._resolvedUrls.get(locationName)
+                # another thread resolved it while this one was waiting
+                if current is not resolved and isValid(current):
+                    return current[1]
+            # only the redirect target is needed, so the body is never downloaded
+            response = self.client.get(href, stream = True)
+            response.close()
+            resolved = (href, response.url, time.time())
+            with self._lock:
+                self._resolvedUrls[locationName] = resolved
+            return resolved[1]
+
+    def update(self, location, finalUrl):
+        """Replaces the memoized final url of location, eg. after VPIS redirected a request somewhere else."""
+
+        locationName = fhswfLocationMap[location]
+        with self._lock:
+            resolved = self._resolvedUrls.get(locationName)
+            if resolved:
+                self._resolvedUrls[locationName] = (resolved[0], finalUrl, resolved[2])
+
+    def invalidate(self, location = None):
+        """Forgets the resolved url of location or of every location and the control document if location is None."""
+
+        with self._lock:
+            if location is None:
+                self._controlXml = None
+                self._resolvedUrls.clear()
+            else:
+                self._resolvedUrls.pop(fhswfLocationMap[location], None)
+
+vpisLocationResolver = VpisLocationResolver()
+
+def buildActivitiesUrl(finalUrl, semester = None, day = None):
+    """Applies the optional semester and day to a resolved location url."""
+
+    if semester:
+        finalUrl = re.sub('[WS]S[0-9]{4}', semester, finalUrl)
+
+    if day:
+        finalUrl += '&Tag=' + day
+
+    return finalUrl
+
+def normalizeRoomString(string):
+    """Normalizes spoken room numbers, so they match the room numbers of VPIS.
+
+    Replaces spoken digits, numbers, letter names and "punkt" by their characters
+    and removes every space, eg. "h vier null neun" => "h409", "zwei punkt fünfzehn" => "2.15".
+    """
+
+    return ''.join(spokenRoomTokens.get(token, token) for token in string.lower().split())
+
+def normalizeSpokenCourseString(string):
+    """Normalizes course names like normalizeCourseString and replaces spoken numbers by digits.
+
+    Used to match spoken course names, eg. "Mathematik eins" => "mathematik 1".
+    """
+
+    return ' '.join(spokenCourseNumbers.get(token, token) for token in normalizeCourseString(string).split())
+
+class FuzzyMatcher:
+    """Precomputed trigram index to find the best matching names for a (misrecognized) spoken name.
+
+    Every name is normalized and split into trigrams. An inverted index maps every trigram to the
+    names containing it, so a query only looks at names sharing at least one trigram with it.
+    Names are ranked by their Dice coefficient of trigrams, equal scores by name.
+
+    Parameters
+    ----------
+    names: iterable
+        Known names, eg. every room or every course.
+
+    normalize: callable, default = None
+        Applied to every name and query before matching, eg. normalizeRoomString.
+    """
+
+    def __init__(self, names, normalize = None):
+        self.normalize = normalize or (lambda string: string.lower())
+        self._names = []
+        self._trigramCounts = []
+        self._byKey = {}
+        self._index = {}
+        for name in dict.fromkeys(names):
+            key = self.normalize(name)
+            if key in self._byKey:
+                continue
+            trigrams = self.trigrams(key)
+            self._byKey[key] = len(self._names)
+            for trigram in trigrams:
+                self._index.setdefault(trigram, []).append(len(self._names))
+            self._names.append(name)
+            self._trigramCounts.append(len(trigrams))
+
+    @staticmethod
+    def trigrams(key):
+        key = '  ' + key + ' '
+        return {key[position:position + 3] for position in range(len(key) - 2)}
+
+    def __len__(self):
+        return len(self._names)
+
+    def match(self, query, limit = 3, minScore = FUZZY_MATCH_MIN_SCORE):
+        """Returns up to limit (name, score) tuples with a score of at least minScore, best match first."""
+
+        key = self.normalize(query)
+        if key in self._byKey:
+            return [(self._names[self._byKey[key]], 1.0)]
+
+        trigrams = self.trigrams(key)
+        shared = Counter(chain.from_iterable(self._index.get(trigram, ()) for trigram in trigrams))
+
+        scores = ((2.0 * count / (len(trigrams) + self._trigramCounts[position]), self._names[position]) for position, count in shared.items())
+        ranked = nsmallest(limit, (score for score in scores if score[0] >= minScore), key = lambda score: (-score[0], score[1]))
+        return [(name, score) for score, name in ranked]
+
+    def candidates(self, query, limit = FUZZY_MATCH_MAX_CHOICES, minScore = FUZZY_MATCH_MIN_SCORE):
+        """Returns up to limit names sharing the best score, more than one if the query is ambiguous."""
+
+        matches = self.match(query, limit, minScore)
+        return [name for name, score in matches if score == matches[0][1]]
+
+    def best(self, query, minScore = FUZZY_MATCH_MIN_SCORE):
+        """Returns the best matching name or None if there is none or several names match equally well."""
+
+        candidates = self.candidates(query, 2, minScore)
+        return candidates[0] if len(candidates) == 1 else None
+
+def resolveDay(dayEntity, today = None):
+    """Resolves a spoken day (see day.entity) to a range of ISO dates.
+
+    Understands relative days ("heute", "morgen", "übermorgen"), weekdays ("montag", "am nächsten freitag"),
+    weeks ("diese woche", "nächste woche") and dates like "12.04.2021", "12.04.", "12. april 2021" or "2021-04-12".
+
+    Parameters
+    ----------
+    dayEntity: string
+        The spoken day. If empty, today is used.
+
+    today: date, default = None
+        Reference date for relative days, defaults to date.today().
+
+    Returns
+    -------
+    dateRange: tuple or None
+        (firstDate, lastDate) as ISO date strings (both inclusive) or None if dayEntity is no valid day.
+    """
+
+    today = today or date.today()
+    day = re.sub(r'\s+', ' ', (dayEntity or '').lower()).strip()
+    day = re.sub(r'^(am|an dem|den|der|die|diese[nmr]?) ', '', day)
+    nextPrefix = re.match(r'(nächsten|naechsten|kommenden) ', day)
+    weekday = weekdays.get(day[nextPrefix.end():] if nextPrefix else day)
+
+    firstDay = lastDay = None
+    if not day:
+        firstDay = today
+    elif day in relativeDays:
+        firstDay = today + timedelta(days = relativeDays[day])
+    elif re.fullmatch(r'(diese )?woche', day):
+        firstDay, lastDay = today, today + timedelta(days = 6 - today.weekday())
+    elif re.fullmatch(r'(nächste|naechste|kommende) woche', day):
+        firstDay = today + timedelta(days = 7 - today.weekday())
+        lastDay = firstDay + timedelta(days = 6)
+    elif weekday is not None:
+        firstDay = today + timedelta(days = (weekday - today.weekday()) % 7)
+        if nextPrefix and firstDay == today:
+            firstDay += timedelta(days = 7)
+    else:
+        match = (re.fullmatch(r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})', day)
+                 or re.fullmatch(r'(?P<day>\d{1,2})\. ?(?P<month>\d{1,2}|[a-zä]+)\.? ?(?P<year>\d{2}|\d{4})?', day))
+        if not match:
+            return None
+        month = match.group('month')
+        month = int(month) if month.isdigit() else months.get(month)
+        year = match.group('year')
+        year = today.year if not year else int(year) + 2000 if len(year) == 2 else int(year)
+        try:
+            firstDay = date(year, month or 0, int(match.group('day')))
+        except ValueError:
+            return None
+
+    return firstDay.isoformat(), (lastDay or firstDay).isoformat()
+
+def writeEntityFile(fileName, entries):
+    """Atomically writes entries (one per line) into fileName, unless it already has the same content.
+
+    The file is written into a temporary file first and renamed afterwards, so a crash never leaves
+    a half written entity file behind.
+
+    Returns
+    -------
+    changed: bool
+        True if the file was (re)written, False if its content was unchanged.
+    """
+
+    content = ''.join(entry + '\n' for entry in entries).encode('utf-8')
+    if exists(fileName):
+        with open(fileName, 'rb') as entityFile:
+            if hashlib.sha1(entityFile.read()).digest() == hashlib.sha1(content).digest():
+                return False
+
+    with open(fileName + '.tmp', 'wb') as entityFile:
+        entityFile.write(content)
+    replace(fileName + '.tmp', fileName)
+    return True
+
+def findFreeRooms(timetable, rooms, slotDate, begin, end):
+    """Finds every room which is free on slotDate from begin to end.
+
+    Parameters
+    ----------
+    timetable: Timetable
+        Activities of the location of rooms.
+
+    rooms: iterable
+        Every room of the location, eg. a value of getRoomsByLocation(). Rooms without any activity are free all day.
+
+    slotDate: string
+        ISO date.
+
+    begin, end: string
+        'HH:MM' strings of the time span the room has to be free.
+
+    Returns
+    -------
+    freeRooms: list
+        (room, freeUntil) tuples, rooms which stay free the longest first.
+    """
+
+    freeRooms = []
+    for room in rooms:
+        for intervalBegin, intervalEnd in timetable.freeIntervals(room, slotDate):
+            if intervalBegin <= begin and intervalEnd >= end:
+                freeRooms.append((room, intervalEnd))
+                break
+            if intervalBegin > begin:
+                break
+    return sorted(freeRooms, key = lambda freeRoom: (-int(freeRoom[1].replace(':', '')), freeRoom[0]))
+
+def joinSpoken(items, conjunction = 'und'):
+    """Joins items for speech output, eg. ['a', 'b', 'c'] => 'a, b und c'."""
+
+    items = list(items)
+    if len(items) < 2:
+        return ''.join(items)
+    return ', '.join(items[:-1]) + ' ' + conjunction + ' ' + items[-1]
+
+def parseSpokenNumber(string):
+    """Returns the number of a spoken number ("2", "zwei") or None."""
+
+    number = spokenRoomTokens.get((string or '').strip().lower(), (string or '').strip())
+    return int(number) if number.isdigit() else None
+
+def formatDay(isoDate):
+    """Formats an ISO date string for speech output, eg. '2021-04-12' => '12.04.2021'."""
+
+    return date.fromisoformat(isoDate).strftime('%d.%m.%Y')
+
+def minutesOfDay(timeOfDay):
+    """Converts a 'HH:MM' string into minutes since midnight."""
+
+    hours, minutes = timeOfDay.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def groupSlots(slots, maxGap = SLOT_MERGE_MAX_GAP):
+    """Merges slots of the same course, type, room and date, which follow each other, into one slot.
+
+    Eg. 08:00-09:30, 09:45-11:15 and 12:00-13:30 of a lab become 08:00-13:30, which is spoken as one item.
+
+    Parameters
+    ----------
+    slots: iterable
+        TimetableSlots sorted by date and begin, eg. as returned by Timetable.slotsInRoom.
+
+    maxGap: int, default = SLOT_MERGE_MAX_GAP
+        Maximum break in minutes between the end of a slot and the begin of the next one to merge them.
+
+    Returns
+    -------
+    slots: list
+        Merged TimetableSlots, still sorted by date and begin.
+    """
+
+    grouped = []
+    lastPositions = {}
+    for slot in slots:
+        key = (slot.room, slot.course, slot.type, slot.date)
+        position = lastPositions.get(key)
+        if position is not None and slot.begin and grouped[position].end and minutesOfDay(slot.begin) - minutesOfDay(grouped[position].end) <= maxGap:
+            if slot.end > grouped[position].end:
+                grouped[position] = grouped[position]._replace(end = slot.end)
+            continue
+        lastPositions[key] = len(grouped)
+        grouped.append(slot)
+    return grouped
+
+class ResponseComposer:
+    """Composes the dialogs of an answer into few utterances instead of one speak_dialog per item.
+
+    Every item may have headings (eg. the room and the day), which are only rendered when they change.
+    The items are split into batches of maxItems, each batch is rendered into a single utterance and
+    repeats the current headings, so it can be understood on its own.
+
+    Parameters
+    ----------
+    translate: callable
+        Renders a dialog with its data into a string, eg. MycroftSkill.translate.
+
+    maxItems: int, default = SPOKEN_ITEMS_PER_BATCH
+        Maximum number of items per utterance.
+    """
+
+    def __init__(self, translate, maxItems = SPOKEN_ITEMS_PER_BATCH):
+        self.translate = translate
+        self.maxItems = max(1, maxItems)
+        self.intro = None
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def setIntro(self, dialog, data = None):
+        """Sets a dialog, which is rendered once at the beginning of the first utterance."""
+
+        self.intro = (dialog, data)
+
+    def add(self, dialog, data = None, headings = ()):
+        """Adds an item, headings is a sequence of (dialog, data) tuples from the outermost to the innermost one."""
+
+        self.items.append(((dialog, data), tuple(headings)))
 
-def getVPISActivities(location, semester = None, day = None):
+    def _render(self, dialog, data):
+        text = self.translate(dialog, data).strip()
+        return text if text.endswith(('.', ':', '!', '?')) else text + '.'
+
+    def utterances(self):
+        """Yields (utterance, remainingItems) for every batch of items."""
+
+        for first in range(0, len(self.items), self.maxItems):
+            parts = [self._render(*self.intro)] if self.intro and not first else []
+            lastHeadings = ()
+            for item, headings in self.items[first:first + self.maxItems]:
+                changed = next((level for level, heading in enumerate(headings)
+                                if level >= len(lastHeadings) or heading != lastHeadings[level]), len(headings))
+                parts.extend(self._render(*heading) for heading in headings[changed:])
+                parts.append(self._render(*item))
+                lastHeadings = headings
+            yield ' '.join(parts), max(0, len(self.items) - first - self.maxItems)
+
+def getVPISActivities(location, semester = None, day = None, dateRange = None):
     """Queries VPIS for ooccupied rooms.
 
     Parameters
@@ -71,191 +1036,500 @@ def getVPISActivities(location, semester = None, day = None):
     day: string, default = None
         VPIS API always uses current day. But if given, we append it to the request url
         to get the data for a specific day.
+
+    dateRange: tuple, default = None
+        (firstDate, lastDate) as ISO date strings. If given, only activity dates within this
+        range (both inclusive) are kept while the response is streamed and parsed.
     
     Returns
     -------
-    occupiedRooms: dict
-        Nested dict containing all activites for the queried day with roomNumber as keys to query for specific activities by roomNumber.
-        
-    courses: dict
-        Nested dict containing all activities for the queried day with courseName as keys to query for specific activity by courseName.
-        
+    timetable: Timetable
+        Every activity slot of the queried semester (or dateRange), indexed by room, course and date.
+
     Notes
     -----
-    An example of the returned data structures:
-    
-    occupiedRooms = { 'Is-H409': { '2021-04-12': { '09:45': { 'Programmierung mit C++2': { 'type': 'Praktikum', 'ende': '11:15' },
-                                                   '08:00': { 'Programmierung mit C++2': { 'type': 'Praktikum', 'ende': '09:30' },
-                                                   '12:00': { 'Programmierung mit C++2': { 'type': 'Praktikum', 'ende': '13:30' }
-                                   },
-                                   '2021-04-19': { '09:45': { 'Programmierung mit C++2': { 'type': 'Praktikum', 'ende': '11:15' },
-                                                   '08:00': { 'Programmierung mit C++2': { 'type': 'Praktikum', 'ende': '09:30' },
-                                                   '12:00': { 'Programmierung mit C++2': { 'type': 'Praktikum', 'ende': '13:30' }
-                                   }
-                      },
-                      'Is-ZE04': { ... }
-    }
-    
-    courses = 'Programmierung mit C++2': { '2021-04-12': { 'Is-H409': { '09:45': { 'type': 'Praktikum', 'end': '11:15' },
-                                                                        '08:00': { 'type': 'Praktikum', 'end': '09:30' },
-                                                                        '12:00': { 'type': 'Praktikum', 'end': '13:30' }
-                                                            }
-                                            },
-                                            '2021-04-19': { 'Is-H409': { '09:45': { 'type': 'Praktikum', 'end': '11:15' },
-                                                                        '08:00': { 'type': 'Praktikum', 'end': '09:30' },
-                                                                        '12:00': { 'type': 'Praktikum', 'end': '13:30' }
-                                                            }
-                                            },
-                'Projekt (Systemintegration)': { ... }
-    }    
+    An example of how to query the returned timetable:
+
+    timetable.slotsInRoom('h409', '2021-04-12', '2021-04-12') = [
+        TimetableSlot(room='h409', course='programmierung mit c++2', type='Praktikum', date='2021-04-12', begin='08:00', end='09:30'),
+        TimetableSlot(room='h409', course='programmierung mit c++2', type='Praktikum', date='2021-04-12', begin='09:45', end='11:15'),
+        TimetableSlot(room='h409', course='programmierung mit c++2', type='Praktikum', date='2021-04-12', begin='12:00', end='13:30')
+    ]
+
+    If metrics are enabled, the stages are recorded as activities.resolve (control document and location url),
+    activities.response (request including redirects and download of the body), activities.parse (parsing,
+    including timetable.index) and activities.total, together with the histogram activities.slots.
+    Unchanged bodies are not parsed at all (counter vpis.unchanged), their size is recorded in vpis.bytes.
     """
     
     if not location in fhswfLocationMap:
         raise AttributeError('Invalid parameter: location')
 
-    vpisControlResponse = requests.get(VPIS_CONTROL_URL,headers = additionalRequestHeaders)
-        
-    if not vpisControlResponse.status_code == 200:
-        raise RuntimeError('Could not connect to VPIS: HTTP status code ' + str(vpisControlResponse.status_code))
-    
-    elif not re.search('application/xml', vpisControlResponse.headers['content-type']):
-        raise RuntimeError('Response is no valid XML.')
+    def parseResponse(vpisResponse):
+        if vpisResponse.status_code == 404:
+            return None
+        elif not vpisResponse.status_code == 200:
+            raise RuntimeError('Could not connect to VPIS: HTTP status code ' + str(vpisResponse.status_code))
+        elif not re.search('application/xml', vpisResponse.headers['content-type']):
+            raise RuntimeError('Response is no valid XML.')
+        elif vpisResponse.history and not semester and not day:
+            # VPIS redirected the memoized url, so remember where it points to now
+            vpisLocationResolver.update(location, vpisResponse.url)
+        metrics.observe('activities.response', time.perf_counter() - requestedAt)
+        with metrics.timer('activities.parse'):
+            timetable = parseVPISActivities(vpisResponse.raw, dateRange)
+        metrics.observe('activities.slots', len(timetable), METRICS_SIZE_BUCKETS)
+        return timetable
 
-    vpisControlXml = vpisControlResponse.content
-    
-    locationsXml = ET.fromstring(vpisControlXml)
-    for locationChild in locationsXml.findall('./locations'):
-        if locationChild.text == fhswfLocationMap[location]:
-            url=locationChild.get('href')
-            break
-    
-    finalUrl = requests.get(url, headers = additionalRequestHeaders).url
-    
-    if semester:
-        finalUrl = re.sub('[WS]S[0-9]{4}', semester, finalUrl)
+    with metrics.timer('activities.total'):
+        with metrics.timer('activities.resolve'):
+            finalUrl = vpisLocationResolver.resolve(location)
+        requestedAt = time.perf_counter()
+        activities = vpisClient.getParsed(buildActivitiesUrl(finalUrl, semester, day), parseResponse, stream = True, variant = dateRange)
+        if activities is None:
+            # the semester url moved (404), resolve it again and retry once
+            vpisLocationResolver.invalidate(location)
+            with metrics.timer('activities.resolve'):
+                finalUrl = vpisLocationResolver.resolve(location, forceRefresh = True)
+            requestedAt = time.perf_counter()
+            activities = vpisClient.getParsed(buildActivitiesUrl(finalUrl, semester, day), parseResponse, stream = True, variant = dateRange)
+            if activities is None:
+                raise RuntimeError('Could not connect to VPIS: HTTP status code 404')
+
+    return activities
+
+def iterVPISActivities(source, dateRange = None):
+    """Streams the activities XML of a location and yields every single slot of every activity.
+
+    The XML is read incrementally with ET.iterparse and every processed element is cleared right
+    away, so memory does not grow with the length of the semester.
+
+    Parameters
+    ----------
+    source: bytes or file-like object
+        The activities XML, eg. the raw stream of a VPIS response.
+
+    dateRange: tuple, default = None
+        (firstDate, lastDate) as ISO date strings. Slots outside of this range (both inclusive) are skipped.
+
+    Yields
+    ------
+    slot: tuple
+        (roomNumber, courseName, courseType, courseDate, courseTimeBegin, courseTimeEnd) with
+        roomNumber in lower case without location prefix and a normalized courseName.
+    """
+
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    firstDate, lastDate = dateRange or (None, None)
+
+    openElements = []
+    for event, element in ET.iterparse(source, events = ('start', 'end')):
+        if event == 'start':
+            openElements.append(element)
+            continue
+        openElements.pop()
+
+        if element.tag == 'activity':
+            # save name, type, all dates(!) for this semester, all rooms(!) for this semester
+            courseName = normalizeCourseString(element.findtext('./name'))
+            courseType = element.findtext('./activity-type')
+            courseDates = [(dateOfDay.get('date'), dateOfDay.get('begin'), dateOfDay.get('end'))
+                           for dateOfDay in element.iterfind('./activity-dates/activity-date')
+                           if (not firstDate or dateOfDay.get('date') >= firstDate) and (not lastDate or dateOfDay.get('date') <= lastDate)]
+
+            # for each room (because at the end of the day, a room can have multiple dates and a date can have multiple times for a course)
+            if courseDates:
+                for room in element.iterfind('./activity-locations/activity-location'):
+                    roomNumber = stripRoomLocationPrefix(room.text)
+                    for courseDate, courseTimeBegin, courseTimeEnd in courseDates:
+                        yield roomNumber, courseName, courseType, courseDate, courseTimeBegin, courseTimeEnd
+
+        # drop every finished child of a top level container (eg. <activities>), nothing refers to it anymore
+        if len(openElements) == 2:
+            openElements[-1].clear()
+
+def parseVPISActivities(source, dateRange = None):
+    """Parses the activities XML of a location into a Timetable.
+
+    See iterVPISActivities for the parameters.
+    """
+
+    return Timetable(iterVPISActivities(source, dateRange))
+
+TimetableSlot = namedtuple('TimetableSlot', ['room', 'course', 'type', 'date', 'begin', 'end'])
+
+class Timetable:
+    """Compact, indexed store of activity slots.
+
+    Every slot is stored once in columns (room, course, type, date, begin, end) of interned strings.
+    Secondary indexes by room, by course and by date hold the positions of the slots sorted by date
+    and begin, so queries for a date range are answered by binary search instead of scanning the
+    whole semester. The store is immutable after construction.
+
+    Parameters
+    ----------
+    slots: iterable, default = ()
+        Tuples of (room, course, type, date, begin, end), eg. as yielded by iterVPISActivities.
+        Dates are ISO date strings, begin and end are 'HH:MM' strings. Slots of the same room,
+        course, date and begin are stored only once, the first one of them is kept.
+    """
+
+    COLUMNS = TimetableSlot._fields
+
+    def __init__(self, slots = ()):
+        self._columns = tuple([] for _ in self.COLUMNS)
+        # the first slot (in input order) of every room, course, date and begin is kept
+        unique = {}
+        for slot in slots:
+            slot = tuple(value or '' for value in slot)
+            unique.setdefault((slot[0], slot[1], slot[3], slot[4]), slot)
+        for slot in sorted(unique.values(), key = lambda slot: (slot[3], slot[4], slot[0], slot[1])):
+            for column, value in zip(self._columns, slot):
+                column.append(sys.intern(value))
+        with metrics.timer('timetable.index'):
+            self._buildIndexes()
+
+    def _buildIndexes(self):
+        # positions are already sorted by (date, begin), so every index is sorted as well
+        rooms, courses, _, dates, _, _ = self._columns
+        self._byRoom = {}
+        self._byCourse = {}
+        self._byDate = {}
+        # per course sorted 'YYYY-MM-DD HH:MM' begin times of its occurrences, parallel to the positions in _byCourse
+        self._courseBegins = {}
+        begins = self._columns[4]
+        for position, (room, course, slotDate) in enumerate(zip(rooms, courses, dates)):
+            self._byRoom.setdefault(room, ([], []))
+            self._byRoom[room][0].append(slotDate)
+            self._byRoom[room][1].append(position)
+            self._byCourse.setdefault(course, ([], []))
+            self._byCourse[course][0].append(slotDate)
+            self._byCourse[course][1].append(position)
+            self._courseBegins.setdefault(course, []).append(slotDate + ' ' + begins[position])
+            self._byDate.setdefault(slotDate, []).append(position)
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    def __iter__(self):
+        return (self._slot(position) for position in range(len(self)))
+
+    def _slot(self, position):
+        return TimetableSlot(*(column[position] for column in self._columns))
+
+    def _query(self, index, key, firstDate, lastDate, begin, end):
+        if key not in index:
+            return []
+        dates, positions = index[key]
+        first = bisect_left(dates, firstDate) if firstDate else 0
+        last = bisect_right(dates, lastDate) if lastDate else len(dates)
+        slots = (self._slot(position) for position in positions[first:last])
+        return [slot for slot in slots if overlaps(slot, begin, end)]
+
+    def rooms(self):
+        """Returns every room with at least one slot."""
+        return self._byRoom.keys()
+
+    def courses(self):
+        """Returns every course with at least one slot."""
+        return self._byCourse.keys()
+
+    def dates(self):
+        """Returns every date with at least one slot."""
+        return self._byDate.keys()
+
+    def columns(self):
+        """Returns the (room, course, type, date, begin, end) columns, sorted by date and begin."""
+        return self._columns
+
+    def slotsInRoom(self, room, firstDate = None, lastDate = None, begin = None, end = None):
+        """Returns the slots of room between firstDate and lastDate (inclusive) overlapping begin to end, sorted by date and begin."""
+        return self._query(self._byRoom, room, firstDate, lastDate, begin, end)
+
+    def slotsOfCourse(self, course, firstDate = None, lastDate = None, begin = None, end = None):
+        """Returns the slots of course between firstDate and lastDate (inclusive) overlapping begin to end, sorted by date and begin."""
+        return self._query(self._byCourse, course, firstDate, lastDate, begin, end)
+
+    def nextOccurrences(self, course, now, limit = 1):
+        """Returns the next limit slots of course beginning at or after now ('YYYY-MM-DD HH:MM'), found by binary search."""
+
+        if course not in self._courseBegins:
+            return []
+        first = bisect_left(self._courseBegins[course], now)
+        return [self._slot(position) for position in self._byCourse[course][1][first:first + limit]]
+
+    def slotsOnDate(self, slotDate, begin = None, end = None):
+        """Returns every slot on slotDate overlapping begin to end, sorted by begin."""
+        slots = (self._slot(position) for position in self._byDate.get(slotDate, ()))
+        return [slot for slot in slots if overlaps(slot, begin, end)]
+
+    def occupiedRooms(self, slotDate, begin = None, end = None):
+        """Returns the set of rooms with a slot on slotDate overlapping begin to end."""
+        return {slot.room for slot in self.slotsOnDate(slotDate, begin, end)}
+
+    def freeRooms(self, rooms, slotDate, begin = None, end = None):
+        """Returns every room of rooms without a slot on slotDate overlapping begin to end (eg. "free rooms now")."""
+        occupied = self.occupiedRooms(slotDate, begin, end)
+        return [room for room in rooms if room not in occupied]
+
+    def freeIntervals(self, room, slotDate, dayBegin = '00:00', dayEnd = '24:00'):
+        """Returns the free (begin, end) intervals of room on slotDate between dayBegin and dayEnd, sorted by begin."""
+
+        intervals = []
+        freeSince = dayBegin
+        for slot in self.slotsInRoom(room, slotDate, slotDate):
+            if slot.begin > freeSince:
+                intervals.append((freeSince, min(slot.begin, dayEnd)))
+            freeSince = max(freeSince, slot.end)
+            if freeSince >= dayEnd:
+                break
+        if freeSince < dayEnd:
+            intervals.append((freeSince, dayEnd))
+        return [(intervalBegin, intervalEnd) for intervalBegin, intervalEnd in intervals if intervalBegin < intervalEnd]
+
+    def slice(self, firstDate = None, lastDate = None):
+        """Returns a new Timetable with only the slots between firstDate and lastDate (inclusive)."""
+
+        dates = self._columns[3]
+        first = bisect_left(dates, firstDate) if firstDate else 0
+        last = bisect_right(dates, lastDate) if lastDate else len(dates)
+        return Timetable(zip(*(column[first:last] for column in self._columns)))
+
+    def toDict(self):
+        """Returns a json serializable representation with every string stored only once."""
+
+        strings = {}
+        columns = [[strings.setdefault(value, len(strings)) for value in column] for column in self._columns]
+        return {'strings': list(strings), 'columns': columns}
+
+    @classmethod
+    def fromDict(cls, content):
+        """Creates a Timetable from the return value of toDict."""
+
+        strings = content['strings']
+        columns = [[strings[value] for value in column] for column in content['columns']]
+        if len(columns) != len(cls.COLUMNS):
+            raise ValueError('Invalid timetable columns')
+        return cls(zip(*columns))
+
+    @classmethod
+    def fromColumns(cls, columns):
+        """Creates a Timetable from the columns of another Timetable, only the indexes are built again."""
+
+        if len(columns) != len(cls.COLUMNS) or len(set(map(len, columns))) > 1:
+            raise ValueError('Invalid timetable columns')
+        timetable = cls.__new__(cls)
+        timetable._columns = tuple(list(column) for column in columns)
+        with metrics.timer('timetable.index'):
+            timetable._buildIndexes()
+        return timetable
+
+def overlaps(slot, begin = None, end = None):
+    """Checks if slot overlaps the time span from begin to end ('HH:MM' strings, open ended if None)."""
+
+    return (not end or slot.begin < end) and (not begin or slot.end > begin)
+
+def getRoomsOfLocation(locationName, url):
+    """Fetches the rooms of a single location.
+
+    Parameters
+    ----------
+    locationName: string
+        Name of the location as used inside the VPIS control document, eg. 'Iserlohn'.
+
+    url: string
+        The location's href from the VPIS control document.
+
+    Returns
+    -------
+    rooms: list
+        Lower case room numbers without location prefix, eg. ['h409', 'ze04'].
+    """
+
+    def parseResponse(vpisLocationResponse):
+        if not vpisLocationResponse.status_code == 200:
+            raise RuntimeError("Could not fetch rooms for {}. HTTP response code: {}".format(locationName, vpisLocationResponse.status_code))
+        elif not re.search('application/xml', vpisLocationResponse.headers['content-type']):
+            raise RuntimeError('Response is no valid XML.')
+        return parseVPISRooms(vpisLocationResponse.content)
+
+    return vpisClient.getParsed(url, parseResponse)
+
+def parseVPISRooms(content):
+    """Parses the rooms (<location> elements) of a location XML into a list of lower case room numbers."""
+
+    rooms = []
+    locationsXml = ET.fromstring(content)
+    for location in locationsXml.findall('./locations/location'):
+        room = stripRoomLocationPrefix(str(location.find('./name').text))
+
+        if room not in rooms:
+            rooms.append(room)
+    return rooms
+
+def getRoomsByLocation(url = VPIS_CONTROL_URL, errors = None):
+    """Generates a dictionary which contains all rooms from all locations for current years semesters for every.
+
+    1. Fetches the VPIS API for any location url.
+    2. Then fetches XML of any location url (concurrently) and gets any <location> element within the <locations> element.
+    3. Fills the dictionary with <number of room> for each <location>
+
+    Parameters
+    ----------
+    url: string, default=VPIS_CONTROL_URL
+        The url to VPIS API control page. Fallbacked to a constant if it changes in future.
+
+    errors: list, default = None
+        If given, failures of single locations are appended to this list and the remaining
+        locations are returned. Otherwise the first failure is raised.
+
+    Returns
+    -------
+    roomNumbersByLocation: dict
+        Contains any room grouped by location. Location therefore is a key of dict fhswfLocationVpisShortKey.
     
-    if day:
-        finalUrl += '&Tag=' + day
+    Notes
+    -----
+    Example of returned data structure:
 
-    vpisResponse = requests.get(finalUrl, headers = additionalRequestHeaders)
-    if not vpisResponse.status_code == 200:
-        raise RuntimeError('Could not connect to VPIS: HTTP status code ' + str(vpisResponse.status_code))
-    elif not re.search('application/xml', vpisResponse.headers['content-type']):
-        raise RuntimeError('Response is no valid XML.')
+    roomNumbersByLocation = {'Hagen': ['au01', 'au06', 'au06-2'],
+                             'Iserlohn': ['a.eg06', 'a.eg11'],
+                             'Lüdenscheid': [ ... ],
+                             ...
+    }
+    """
+
+    if url == vpisLocationResolver.controlUrl:
+        controlXml = vpisLocationResolver.getControlXml()
+    else:
+        controlXml = vpisClient.getParsed(url, parseVpisXmlResponse)
+
+    locationUrls = {}
+    for locationChild in controlXml.findall('./locations'):
+        if locationChild.text in fhswfLocationMap.values() and locationChild.text not in locationUrls:
+            locationUrls[str(locationChild.text)] = locationChild.get('href')
+
+    roomNumbersByLocation = {}
+    with ThreadPoolExecutor(max_workers = VPIS_MAX_WORKERS) as executor:
+        futures = {locationName: executor.submit(getRoomsOfLocation, locationName, locationUrl)
+                   for locationName, locationUrl in locationUrls.items()}
+        for locationName, future in futures.items():
+            try:
+                rooms = future.result()
+            except Exception as err:
+                if errors is None:
+                    raise
+                errors.append('rooms of {}: {}'.format(locationName, err))
+                continue
+            if rooms:
+                roomNumbersByLocation[locationName] = rooms
+    return roomNumbersByLocation
+
+def getCoursesOfLocationPage(locationKey, semester):
+    """Fetches the normalized course names of a single location and semester.
+
+    Parameters
+    ----------
+    locationKey: string
+        A value of fhswfLocationVpisShortKey, eg. 'Is'.
+
+    semester: string
+        Semester like 'SS2021' or 'WS2021'.
+
+    Returns
+    -------
+    courseNames: list or None
+        Normalized course names or None if VPIS has no page for this semester.
+    """
+
+    url = VPIS_BASE_URL + re.sub(';SEMESTER;', semester, VPIS_COURSES_URL_LOCATION)
+
+    def parseResponse(site):
+        if not site.status_code == 200:
+            return None
+
+        chunks = iter(lambda: site.raw.read(64 * 1024), b'')
+        return extractCourseNames(codecs.iterdecode(chunks, site.encoding or 'utf-8', errors = 'replace'))
+
+    return vpisClient.getParsed(url, parseResponse, params = {'Fachbereich': locationKey, 'sort': 'fachname', 'Template': 'None'}, stream = True)
+
+class CourseSpanExtractor(HTMLParser):
+    """Collects the text of every <span style="white-space:nowrap;"> of a course page without building a DOM.
+
+    Texts are kept in document order of the opening tags. The text of a span includes the
+    text of nested elements, just like BeautifulSoup's .text. Like BeautifulSoup, an end tag
+    closes every element opened after the matching start tag, eg. </td> closes an unclosed span.
+    """
+
+    # elements without end tag, they are never pushed onto the stack of open elements
+    VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link',
+                               'menuitem', 'meta', 'param', 'source', 'spacer', 'track', 'wbr'))
+
+    def __init__(self):
+        super().__init__(convert_charrefs = True)
+        self.texts = []
+        # tag names of every open element
+        self._openElements = []
+        # one entry per open course span: (position in _openElements, index into texts)
+        self._openSpans = []
 
-    vpisResponseXml = ET.fromstring(vpisResponse.content)
-    occupiedRooms = {}
-    courses = {}
-
-    # for each <activity> element within <activities> element inside XML
-    # "for each course..."
-    for activityXML in vpisResponseXml.findall('./activities/activity'):
-        # ... save name, type, all dates(!) for this semester, all rooms(!) for this semester
-        courseName=normalizeCourseString(activityXML.find('./name').text)
-        courseType=activityXML.find('./activity-type').text
-        courseDates=activityXML.findall('./activity-dates/activity-date')
-        courseRooms=activityXML.findall('./activity-locations/activity-location')
-
-        # for each room (because at the end of the day, a room can have multiple dates and a date can have multiple times for a course)
-        for room in courseRooms:
-            roomNumber = room.text
-            roomNumberWithoutLocationPrefix = re.findall(r'(?:[A-Za-z]{2}-)(.*)', roomNumber)[0]
-            roomNumber = roomNumberWithoutLocationPrefix.lower()
-            for dateOfDay in courseDates:
-                courseDate = dateOfDay.get('date')
-                courseTimeBegin = dateOfDay.get('begin')
-                courseTimeEnd = dateOfDay.get('end')
-                courseDetails = {'type': courseType, 'end': courseTimeEnd}
-                
-                # fill occupiedRooms:
-                if roomNumber not in occupiedRooms:
-                    occupiedRooms[roomNumber] = {}
-                if courseDate not in occupiedRooms[roomNumber]:
-                    occupiedRooms[roomNumber][courseDate] = {}
-                if courseTimeBegin not in occupiedRooms[roomNumber][courseDate]:
-                    occupiedRooms[roomNumber][courseDate][courseTimeBegin] = {}
-                if courseName not in occupiedRooms[roomNumber][courseDate][courseTimeBegin]:
-                    occupiedRooms[roomNumber][courseDate][courseTimeBegin][courseName] = courseDetails
-                
-                # fill courses:
-                if courseName not in courses:
-                    courses[courseName] = {}
-                if courseDate not in courses[courseName]:
-                    courses[courseName][courseDate] = {}
-                if roomNumber not in courses[courseName][courseDate]:
-                    courses[courseName][courseDate][roomNumber] = {}
-                if courseTimeBegin not in courses[courseName][courseDate][roomNumber]:
-                    courses[courseName][courseDate][roomNumber][courseTimeBegin] = courseDetails
-        
-    return occupiedRooms, courses
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID_ELEMENTS:
+            return
+        if tag == 'span' and dict(attrs).get('style') == 'white-space:nowrap;':
+            self._openSpans.append((len(self._openElements), len(self.texts)))
+            self.texts.append([])
+        self._openElements.append(tag)
 
-def getRoomsByLocation(url = VPIS_CONTROL_URL):
-    """Generates a dictionary which contains all rooms from all locations for current years semesters for every.
+    def handle_endtag(self, tag):
+        # end tags without a matching open element are ignored
+        for position in range(len(self._openElements) - 1, -1, -1):
+            if self._openElements[position] == tag:
+                del self._openElements[position:]
+                while self._openSpans and self._openSpans[-1][0] >= position:
+                    self._openSpans.pop()
+                return
 
-    1. Fetches the VPIS API for any location url.
-    2. Then fetches XML of any location url and gets any <location> element within the <locations> element.
-    3. Fills the dictionary with <number of room> for each <location>
+    def handle_data(self, data):
+        for _, index in self._openSpans:
+            self.texts[index].append(data)
+
+def extractCourseNames(chunks):
+    """Extracts the normalized course names of a course page (faecherangebotplanung.php3).
 
     Parameters
     ----------
-    url: string, default=VPIS_CONTROL_URL
-        The url to VPIS API control page. Fallbacked to a constant if it changes in future.
+    chunks: iterable
+        The decoded HTML, eg. in chunks as they arrive. A single string works as well.
 
     Returns
     -------
-    roomNumbersByLocation: dict
-        Contains any room grouped by location. Location therefore is a key of dict fhswfLocationVpisShortKey.
-    
-    Notes
-    -----
-    Example of returned data structure:
-
-    roomNumbersByLocation = {'Hagen': ['au01', 'au06', 'au06-2'],
-                             'Iserlohn': ['a.eg06', 'a.eg11'],
-                             'Lüdenscheid': [ ... ],
-                             ...
-    }
+    courseNames: list
+        Normalized names of every course in document order.
     """
 
-    vpisControlResponse = requests.get(url, headers = additionalRequestHeaders)
-    if not vpisControlResponse.status_code == 200:
-        raise RuntimeError("Connect to " + url + " failed. HTTP response code: " + vpisControlResponse.status_code)
-    elif not re.search('application/xml', vpisControlResponse.headers['content-type']):
-        raise RuntimeError('Response is no valid XML.')
-    
-    controlXml = ET.fromstring(vpisControlResponse.content)
- 
-    roomNumbersByLocation = {}
-    for locationChild in controlXml.findall('./locations'):
-        # for fhswfLocation in fhswfLocationVpisShortKey.keys():
-        if locationChild.text not in fhswfLocationMap.values():
-            continue
-        vpisLocationResponse = requests.get(locationChild.get('href'), headers = additionalRequestHeaders)
-        if not vpisLocationResponse.status_code == 200:
-            raise RuntimeError("Could not fetch rooms for {}. HTTP response code: {}".format(locationChild.text, vpisLocationResponse.status_code))
-        elif not re.search('application/xml', vpisLocationResponse.headers['content-type']):
-            raise RuntimeError('Response is no valid XML.')
-        
-        locationsXml = ET.fromstring(vpisLocationResponse.content)
-        for location in locationsXml.findall('./locations/location'):
-            locationName = str(locationChild.text)
-            room = str(location.find('./name').text)
-            roomWithoutLocationPrefix = re.findall(r'(?:[A-Za-z]{2}-)(.*)', room)[0]
-            room = roomWithoutLocationPrefix.lower()
-
-            if locationName not in roomNumbersByLocation:
-                roomNumbersByLocation[locationName] = []
-            if room not in roomNumbersByLocation[locationName]:
-                roomNumbersByLocation[locationName].append(room)
-    return roomNumbersByLocation
+    if isinstance(chunks, str):
+        chunks = (chunks,)
+    extractor = CourseSpanExtractor()
+    for chunk in chunks:
+        extractor.feed(chunk)
+    extractor.close()
+    return [normalizeCourseString(''.join(text)) for text in extractor.texts]
 
-def getCoursesByLocation():
+def getCoursesByLocation(errors = None):
     """Generates a dictionary which contains all courses from all locations for current years semesters.
 
-    1. Fetches the VPIS API for any location.
+    1. Fetches the VPIS API for any location and semester (concurrently).
     2. Then fetches all <span> elements with a style attribute of "white-space:nowrap;" from the HTML response
     3. Fills the dictionary with normalized <courseName> for each <location> based on the text inside the <span>
 
+    Parameters
+    ----------
+    errors: list, default = None
+        If given, failures of single pages are appended to this list and the remaining
+        courses are returned. Otherwise the first failure is raised.
+
     Returns
     -------
     overallCoursesByLocation: dict
@@ -274,24 +1548,26 @@ def getCoursesByLocation():
 
     overallCoursesByLocation = {}
     today = date.today()
-    
-    for locationKey in fhswfLocationVpisShortKey.values():
-        urlLocations = [ re.sub(';SEMESTER;', 'SS' + str(today.year), VPIS_COURSES_URL_LOCATION), re.sub(';SEMESTER;', 'WS' + str(today.year), VPIS_COURSES_URL_LOCATION) ]
-        
-        for urlLocation in urlLocations:
-            url = VPIS_BASE_URL + urlLocation
-            site = requests.get(url, params = {'Fachbereich': locationKey, 'sort': 'fachname', 'Template': 'None'}, headers = additionalRequestHeaders)
-            if not site.status_code == 200:
+    semesters = ['SS' + str(today.year), 'WS' + str(today.year)]
+
+    with ThreadPoolExecutor(max_workers = VPIS_MAX_WORKERS) as executor:
+        # keep submission order, so duplicates are removed in the same order as before
+        futures = [(locationKey, semester, executor.submit(getCoursesOfLocationPage, locationKey, semester))
+                   for locationKey in fhswfLocationVpisShortKey.values() for semester in semesters]
+        for locationKey, semester, future in futures:
+            try:
+                courseNames = future.result()
+            except Exception as err:
+                if errors is None:
+                    raise
+                errors.append('courses of {} ({}): {}'.format(locationKey, semester, err))
+                continue
+            if courseNames is None:
                 continue
-            
+
             if not locationKey in overallCoursesByLocation:
                 overallCoursesByLocation[locationKey] = []
-            site = BeautifulSoup(site.text)
-            courseTags = site.findAll("span", {"style": "white-space:nowrap;"})
-            
-            for courseTag in courseTags:
-                courseName = normalizeCourseString(str(courseTag.text))
-                overallCoursesByLocation[locationKey].append(courseName)
+            overallCoursesByLocation[locationKey].extend(courseNames)
     
     # remove possible (equally written) duplicates:
     for a in overallCoursesByLocation:
@@ -299,6 +1575,415 @@ def getCoursesByLocation():
     
     return overallCoursesByLocation
 
+class TimetableCache:
+    """Size bounded LRU cache for parsed VPIS timetables with disk persistence.
+
+    Entries are keyed by tuples like (location, semester, day, firstDate, lastDate) and hold whatever
+    the loader returned (for getVPISActivities a Timetable). An entry younger than ttl
+    is served directly. An entry older than ttl but younger than staleTtl is served as well,
+    while a background thread fetches a fresh copy (stale-while-revalidate). Anything older
+    is loaded synchronously.
+
+    Every entry is also written as JSON file into cacheDir, so a restarted skill can answer
+    from the last known state instead of cold fetching every location.
+
+    Parameters
+    ----------
+    cacheDir: string, default = None
+        Directory for persisted entries. Persistence is disabled if None.
+
+    ttl: int, default = TIMETABLE_CACHE_TTL
+        Seconds an entry is considered fresh.
+
+    staleTtl: int, default = TIMETABLE_CACHE_STALE_TTL
+        Seconds an entry may be served stale while it is being revalidated.
+
+    maxEntries: int, default = TIMETABLE_CACHE_MAX_ENTRIES
+        Maximum number of entries held in memory and on disk. Least recently used entries are evicted first.
+
+    encode: callable, default = None
+        Converts a cached value into something json serializable.
+
+    decode: callable, default = None
+        Converts a deserialized json value back into the cached value.
+    """
+
+    def __init__(self, cacheDir = None, ttl = TIMETABLE_CACHE_TTL, staleTtl = TIMETABLE_CACHE_STALE_TTL,
+                 maxEntries = TIMETABLE_CACHE_MAX_ENTRIES, encode = None, decode = None):
+        self.cacheDir = cacheDir
+        self.ttl = ttl
+        self.staleTtl = max(staleTtl, ttl)
+        self.maxEntries = maxEntries
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self._entries = OrderedDict()
+        # fetchedAt of the persisted copy of every entry
+        self._persistedAt = {}
+        self._refreshing = set()
+        self._lock = threading.RLock()
+
+        if self.cacheDir:
+            makedirs(self.cacheDir, exist_ok = True)
+            self._loadPersistedEntries()
+
+    def get(self, key, loader):
+        """Returns the cached value for key, loading (or revalidating) it with loader if needed.
+
+        Parameters
+        ----------
+        key: tuple
+            Cache key, eg. ('Iserlohn', None, '2021-04-12').
+
+        loader: callable
+            Called without arguments to fetch a fresh value.
+
+        Returns
+        -------
+        value: any
+            Cached or freshly loaded value.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                fetchedAt, value = entry
+                age = time.time() - fetchedAt
+                if age < self.ttl:
+                    metrics.count('cache.hit')
+                    return value
+                if age < self.staleTtl:
+                    metrics.count('cache.stale')
+                    self._revalidate(key, loader)
+                    return value
+
+        metrics.count('cache.miss')
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def contains(self, key):
+        """Checks if there is an entry for key which is still allowed to be served (fresh or stale)."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            return bool(entry) and time.time() - entry[0] < self.staleTtl
+
+    def peek(self, key):
+        """Returns the cached value for key regardless of its age or None if there is no entry."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry else None
+
+    def put(self, key, value, fetchedAt = None):
+        """Stores value for key, persists it and evicts least recently used entries.
+
+        A value which is the very same object as the cached one (eg. VpisClient.getParsed reused the parsed
+        result of an unchanged document) is only written again once its persisted copy is older than half
+        of staleTtl, so regular refreshes of unchanged timetables do not rewrite the cache files.
+        """
+
+        fetchedAt = fetchedAt or time.time()
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = (fetchedAt, value)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.maxEntries:
+                evicted.append(self._entries.popitem(last = False)[0])
+            unchanged = previous is not None and previous[1] is value and fetchedAt - self._persistedAt.get(key, 0) < self.staleTtl / 2
+
+        if not unchanged:
+            self._persist(key, fetchedAt, value)
+        for evictedKey in evicted:
+            self._removePersisted(evictedKey)
+
+    def clear(self):
+        """Drops every entry from memory and disk."""
+
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+        for key in keys:
+            self._removePersisted(key)
+
+    def _revalidate(self, key, loader):
+        # only one refresh per key at a time, the caller already holds self._lock
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.put(key, loader())
+            except Exception:
+                # keep serving the stale entry, the next access will try again
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target = refresh, daemon = True).start()
+
+    def _fileName(self, key):
+        return join(self.cacheDir, hashlib.sha1(json.dumps(list(key)).encode('utf-8')).hexdigest() + '.json')
+
+    def _persist(self, key, fetchedAt, value):
+        if not self.cacheDir:
+            return
+        fileName = self._fileName(key)
+        try:
+            with open(fileName + '.tmp', 'w', encoding = 'utf-8') as cacheFile:
+                json.dump({'key': list(key), 'fetchedAt': fetchedAt, 'value': self.encode(value)}, cacheFile)
+            replace(fileName + '.tmp', fileName)
+            self._persistedAt[key] = fetchedAt
+        except (OSError, TypeError, ValueError):
+            # persistence is only an optimization for restarts
+            pass
+
+    def _removePersisted(self, key):
+        self._persistedAt.pop(key, None)
+        if not self.cacheDir:
+            return
+        fileName = self._fileName(key)
+        if exists(fileName):
+            try:
+                remove(fileName)
+            except OSError:
+                pass
+
+    def _loadPersistedEntries(self):
+        persisted = []
+        for fileName in listdir(self.cacheDir):
+            if not fileName.endswith('.json'):
+                continue
+            try:
+                with open(join(self.cacheDir, fileName), encoding = 'utf-8') as cacheFile:
+                    content = json.load(cacheFile)
+                persisted.append((content['fetchedAt'], tuple(content['key']), self.decode(content['value'])))
+            except (OSError, KeyError, TypeError, ValueError):
+                try:
+                    remove(join(self.cacheDir, fileName))
+                except OSError:
+                    pass
+
+        # oldest first, so the LRU order matches the age of the entries
+        for fetchedAt, key, value in sorted(persisted, key = lambda entry: entry[0]):
+            if time.time() - fetchedAt < self.staleTtl:
+                self._entries[key] = (fetchedAt, value)
+                self._persistedAt[key] = fetchedAt
+            else:
+                self._removePersisted(key)
+        while len(self._entries) > self.maxEntries:
+            self._removePersisted(self._entries.popitem(last = False)[0])
+
+def packUint32(values):
+    """Returns values as little endian uint32 bytes."""
+
+    packed = array('I', values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+def writeSnapshot(fileName, timetables, roomsByLocation, coursesByLocation, createdAt = None):
+    """Writes timetables, rooms and courses into a compact binary snapshot file, replacing it atomically.
+
+    Every string is stored once in a string table, everything else as little endian uint32 indexes into it.
+    The file consists of:
+
+    1. SNAPSHOT_HEADER
+    2. one SNAPSHOT_SECTION entry per timetable, room list and course list
+    3. the end offsets of the strings (uint32) and the UTF-8 encoded strings, padded to 4 bytes
+    4. the data of every section: 6 columns of uint32 for timetables, one for rooms and courses
+
+    Parameters
+    ----------
+    fileName: string
+        Path of the snapshot file.
+
+    timetables: dict
+        Timetables keyed by (locationName, semester), semester None for the current semester.
+
+    roomsByLocation: dict
+        As returned by getRoomsByLocation.
+
+    coursesByLocation: dict
+        As returned by getCoursesByLocation.
+
+    createdAt: float, default = None
+        Timestamp of the data, defaults to now.
+    """
+
+    strings = {'': 0}
+    def index(value):
+        return strings.setdefault(value or '', len(strings))
+
+    sections = []
+    for (locationName, semester), timetable in timetables.items():
+        columns = timetable.columns()
+        sections.append((SNAPSHOT_TIMETABLE, index(locationName), index(semester), len(timetable),
+                         packUint32(index(value) for column in columns for value in column)))
+    for kind, entries in ((SNAPSHOT_ROOMS, roomsByLocation), (SNAPSHOT_COURSES, coursesByLocation)):
+        for key, values in entries.items():
+            sections.append((kind, index(key), 0, len(values), packUint32(index(value) for value in values)))
+
+    encoded = [value.encode('utf-8') for value in strings]
+    stringOffsets = packUint32(chain([0], accumulate(map(len, encoded))))
+    stringData = b''.join(encoded)
+    stringData += b'\0' * (-len(stringData) % 4)
+
+    offset = SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * len(sections) + len(stringOffsets) + len(stringData)
+    directory = []
+    for kind, key, semester, rows, data in sections:
+        directory.append(SNAPSHOT_SECTION.pack(kind, key, semester, rows, offset))
+        offset += len(data)
+
+    with open(fileName + '.tmp', 'wb') as snapshotFile:
+        snapshotFile.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, createdAt or time.time(), len(strings), len(sections)))
+        snapshotFile.write(b''.join(directory))
+        snapshotFile.write(stringOffsets)
+        snapshotFile.write(stringData)
+        for section in sections:
+            snapshotFile.write(section[4])
+    replace(fileName + '.tmp', fileName)
+
+def buildSnapshot(fileName, semesters = (), errors = None):
+    """Fetches the timetables of every location (current semester and semesters), rooms and courses and writes a snapshot.
+
+    Parameters
+    ----------
+    fileName: string
+        Path of the snapshot file.
+
+    semesters: iterable, default = ()
+        Additional semesters like 'SS2021' or 'WS2021', the current semester is always included.
+
+    errors: list, default = None
+        If given, failures of single locations are appended to this list. Otherwise the first failure is raised.
+
+    Returns
+    -------
+    timetables: dict
+        The written timetables keyed by (locationName, semester).
+    """
+
+    keys = [(locationName, semester) for locationName in fhswfLocationVpisShortKey for semester in chain([None], semesters)]
+    timetables = {}
+    with ThreadPoolExecutor(max_workers = VPIS_MAX_WORKERS) as executor:
+        roomsFuture = executor.submit(getRoomsByLocation, errors = errors)
+        coursesFuture = executor.submit(getCoursesByLocation, errors = errors)
+        futures = [(key, executor.submit(getVPISActivities, key[0].lower(), key[1])) for key in keys]
+        for key, future in futures:
+            try:
+                timetables[key] = future.result()
+            except Exception as err:
+                if errors is None:
+                    raise
+                errors.append('activities of {} ({}): {}'.format(key[0], key[1] or 'current semester', err))
+        roomsByLocation = roomsFuture.result()
+        coursesByLocation = coursesFuture.result()
+
+    writeSnapshot(fileName, timetables, roomsByLocation, coursesByLocation)
+    return timetables
+
+class Snapshot:
+    """Read-only, memory mapped snapshot file as written by writeSnapshot.
+
+    Opening a snapshot reads the header, the section directory and the string table and checks that
+    every section lies within the file. Timetables are only built from the mapped file when requested.
+
+    Parameters
+    ----------
+    fileName: string
+        Path of the snapshot file.
+
+    Raises ValueError if the file is no snapshot or has another SNAPSHOT_VERSION.
+    """
+
+    def __init__(self, fileName):
+        with open(fileName, 'rb') as snapshotFile:
+            self._map = mmap.mmap(snapshotFile.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            magic, version, _, self.createdAt, stringCount, sectionCount = SNAPSHOT_HEADER.unpack_from(self._map)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError('unsupported format or version')
+
+            stringOffsetsStart = SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * sectionCount
+            stringOffsets = self._uint32(stringOffsetsStart, stringCount + 1)
+            stringDataStart = stringOffsetsStart + 4 * (stringCount + 1)
+            if stringDataStart + stringOffsets[-1] > len(self._map):
+                raise IndexError('string table exceeds the file')
+            stringData = self._map[stringDataStart:stringDataStart + stringOffsets[-1]]
+            self.strings = [sys.intern(stringData[begin:end].decode('utf-8')) for begin, end in zip(stringOffsets, stringOffsets[1:])]
+
+            self.sections = {}
+            self._timetables = {}
+            for position in range(sectionCount):
+                kind, key, semester, rows, offset = SNAPSHOT_SECTION.unpack_from(self._map, SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * position)
+                if kind not in (SNAPSHOT_TIMETABLE, SNAPSHOT_ROOMS, SNAPSHOT_COURSES):
+                    raise ValueError('unknown section kind {}'.format(kind))
+                # check every section up front, so a truncated or partially copied file is never opened
+                values = self._uint32(offset, rows * (len(Timetable.COLUMNS) if kind == SNAPSHOT_TIMETABLE else 1))
+                if values and max(values) >= stringCount:
+                    raise IndexError('section refers to unknown strings')
+                self.sections[(kind, self.strings[key], self.strings[semester] or None)] = (rows, offset)
+        except (struct.error, IndexError, ValueError) as err:
+            self.close()
+            raise ValueError('Invalid snapshot file {}: {}'.format(fileName, err))
+
+    def _uint32(self, offset, count):
+        if offset + 4 * count > len(self._map):
+            raise IndexError('section exceeds the file')
+        values = array('I')
+        values.frombytes(self._map[offset:offset + 4 * count])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def _strings(self, kind, key, semester = None):
+        section = self.sections.get((kind, key, semester))
+        if not section:
+            return None
+        rows, offset = section
+        strings = self.strings
+        return [strings[value] for value in self._uint32(offset, rows)]
+
+    def timetableKeys(self):
+        """Returns the (locationName, semester) keys of every timetable in the snapshot."""
+
+        return [(key, semester) for kind, key, semester in self.sections if kind == SNAPSHOT_TIMETABLE]
+
+    def timetable(self, locationName, semester = None):
+        """Returns the Timetable of locationName and semester (None for the current one) or None if it is missing."""
+
+        key = (locationName, semester)
+        if key in self._timetables:
+            return self._timetables[key]
+        section = self.sections.get((SNAPSHOT_TIMETABLE, locationName, semester))
+        if not section:
+            return None
+        rows, offset = section
+        values = self._uint32(offset, rows * len(Timetable.COLUMNS))
+        strings = self.strings
+        timetable = Timetable.fromColumns([[strings[value] for value in values[column * rows:(column + 1) * rows]]
+                                           for column in range(len(Timetable.COLUMNS))])
+        self._timetables[key] = timetable
+        return timetable
+
+    def roomsByLocation(self):
+        """Returns the rooms of every location like getRoomsByLocation."""
+
+        return {key: self._strings(SNAPSHOT_ROOMS, key) for kind, key, _ in self.sections if kind == SNAPSHOT_ROOMS}
+
+    def coursesByLocation(self):
+        """Returns the courses of every location like getCoursesByLocation."""
+
+        return {key: self._strings(SNAPSHOT_COURSES, key) for kind, key, _ in self.sections if kind == SNAPSHOT_COURSES}
+
+    def close(self):
+        self._map.close()
+
 class FhSwfRoomQuerySkill(MycroftSkill):
     """FhSwfRoomQuerySkill provides Mycroft with the ability to query for room occupancy within FH-SWF.
 
@@ -325,45 +2010,323 @@ class FhSwfRoomQuerySkill(MycroftSkill):
         self.register_entity_file('location.entity')
         self.register_entity_file('day.entity')
 
+        # optional instrumentation of the hot paths, summarized into the log, a json file and a local http endpoint
+        metrics.enabled = self.settings.get('metrics', False)
+        self.metricsServer = None
+        if metrics.enabled:
+            self.schedule_repeating_event(self.exportMetrics, None, self.settings.get('metricsLogInterval', METRICS_LOG_INTERVAL),
+                                          name = 'ExportMetrics')
+            if self.settings.get('metricsPort'):
+                try:
+                    self.metricsServer = MetricsServer(metrics, self.settings.get('metricsPort'))
+                except OSError as err:
+                    self.log.warning('Could not serve metrics on port {}: {}'.format(self.settings.get('metricsPort'), err))
+
+        # the snapshot answers while VPIS is not reachable, built with tools/snapshot.py
+        self.snapshot = None
+        snapshotFile = join(self.root_dir, self.settings.get('snapshotFile', SNAPSHOT_FILE))
+        if exists(snapshotFile):
+            try:
+                with metrics.timer('snapshot.load'):
+                    self.snapshot = Snapshot(snapshotFile)
+                self.log.info('Loaded snapshot of {}'.format(datetime.fromtimestamp(self.snapshot.createdAt).strftime('%Y-%m-%d %H:%M')))
+            except (OSError, ValueError) as err:
+                self.log.warning('Could not load snapshot: {}'.format(err))
+
+        # parsed activities are cached per (location, semester, day) and survive restarts
+        self.activitiesCache = TimetableCache(join(self.root_dir, TIMETABLE_CACHE_DIR),
+                                              ttl = self.settings.get('cacheTtl', TIMETABLE_CACHE_TTL),
+                                              staleTtl = self.settings.get('cacheStaleTtl', TIMETABLE_CACHE_STALE_TTL),
+                                              maxEntries = self.settings.get('cacheMaxEntries', TIMETABLE_CACHE_MAX_ENTRIES),
+                                              encode = Timetable.toDict,
+                                              decode = Timetable.fromDict)
+
+        # intent handlers fetch their timetables in the background and answer once they arrived,
+        # queries over several locations fetch them concurrently
+        self.queryExecutor = ThreadPoolExecutor(max_workers = VPIS_MAX_WORKERS)
+        self.pendingQueries = set()
+        self.queryGeneration = 0
+        self.queryLock = threading.Lock()
+        self.lastLocation = None
+
+        # keep the semester timetable of every location warm, so intent handlers answer from memory
+        self.prefetchPosition = 0
+        if self.settings.get('prefetch', True):
+            self.schedule_event(self.prefetchNextLocation, PREFETCH_STARTUP_DELAY, name = 'PrefetchActivities')
+
         # We need to build our room.entity and course.entity "dynamically" here (fetching from vpis)
         # and register afterwards
         
-        # fetch rooms and build room.entity #
-        self.roomsByLocation = getRoomsByLocation()
-        if not self.roomsByLocation:
-             self.log.error('No room entities. Skill may not function properly!')
-        else:
-            self.log.info('Generating room.entity for every locale')
-            for localeDir in listdir(join(self.root_dir, 'locale')):
-                roomEntityFile = open(join(self.root_dir, 'locale', localeDir, 'room.entity'), 'w')
-                for rooms in self.roomsByLocation.values():
-                    if not rooms:
-                        continue
-                    for roomNr in rooms:
-                        roomEntityFile.writelines(roomNr + '\n')
-                roomEntityFile.close()
-            self.register_entity_file('room.entity')
+        # fetch rooms and courses concurrently, failures of single locations are reported together #
+        fetchErrors = []
+        fetched = {}
+        with ThreadPoolExecutor(max_workers = 2) as executor:
+            futures = {'rooms': executor.submit(getRoomsByLocation, errors = fetchErrors),
+                       'courses': executor.submit(getCoursesByLocation, errors = fetchErrors)}
+            for name, future in futures.items():
+                try:
+                    fetched[name] = future.result()
+                except Exception as err:
+                    fetched[name] = {}
+                    fetchErrors.append('{}: {}'.format(name, err))
+        if fetchErrors:
+            self.log.error('Fetching from VPIS failed for:\n' + '\n'.join(fetchErrors))
+        if self.snapshot:
+            # locations which could not be fetched are answered with the rooms and courses of the snapshot
+            for name, snapshotEntries in (('rooms', self.snapshot.roomsByLocation()), ('courses', self.snapshot.coursesByLocation())):
+                for key, entries in snapshotEntries.items():
+                    fetched[name].setdefault(key, entries)
+
+        # build room.entity #
+        self.roomsByLocation = fetched['rooms']
+        self.buildEntityFile('room.entity', (room for rooms in self.roomsByLocation.values() for room in rooms))
         # end of room.entity building #
 
-        # fetch courses and build course.entity #
-        self.coursesByLocation = getCoursesByLocation()
-        if not self.coursesByLocation:
-            self.log.error('No course entities. Skill may not function properly!')
-        else:
-            print('Generating course.entity for every locale')
-            for localeDir in listdir(join(self.root_dir, 'locale')):
-                    entityFile = open(join(self.root_dir, 'locale', localeDir, 'course.entity'), 'w')
-                    for courses in self.coursesByLocation.values():
-                        if not courses:
-                            continue
-                        for course in courses:
-                            entityFile.writelines(course.lower() + '\n')
-                    entityFile.close()
-            self.register_entity_file('course.entity')
+        # build course.entity #
+        self.coursesByLocation = fetched['courses']
+        self.buildEntityFile('course.entity', (course.lower() for courses in self.coursesByLocation.values() for course in courses))
         # end of course.entity building #
 
+        # indexes to match misrecognized spoken rooms and courses #
+        self.roomMatcher = FuzzyMatcher((room for rooms in self.roomsByLocation.values() for room in rooms), normalizeRoomString)
+        self.roomMatchersByLocation = {locationName: FuzzyMatcher(rooms, normalizeRoomString) for locationName, rooms in self.roomsByLocation.items()}
+        self.courseMatcher = FuzzyMatcher((course for courses in self.coursesByLocation.values() for course in courses), normalizeSpokenCourseString)
+
         self.log.info('FhRoomOccupancySkill initialized.')
 
+    def getActivities(self, location, semester = None, dateRange = None):
+        """Returns the Timetable of getVPISActivities for dateRange, but served from activitiesCache.
+
+        If the whole semester of location is cached already, the requested days are sliced from it.
+        If not, but the snapshot is younger than the stale ttl of the cache, they are sliced from the
+        timetable of the snapshot until prefetching caches the semester. Otherwise a single day is
+        requested with VPIS' day parameter and a range of days with a single request of the semester,
+        which is filtered to the range while it is parsed.
+
+        If VPIS can not be reached or sends a broken document, the timetable of the snapshot is used if there is one.
+        Raises AttributeError for invalid locations just like getVPISActivities.
+        """
+
+        if not location in fhswfLocationMap:
+            raise AttributeError('Invalid parameter: location')
+
+        locationName = fhswfLocationMap[location]
+        semesterKey = (locationName, semester, None, None, None)
+        snapshotIsRecent = self.snapshot and time.time() - self.snapshot.createdAt < self.activitiesCache.staleTtl
+        if snapshotIsRecent and not self.activitiesCache.contains(semesterKey):
+            # a recent snapshot saves every device from downloading the same semesters again
+            timetable = self.snapshot.timetable(locationName, semester)
+            if timetable is not None:
+                metrics.count('snapshot.hit')
+                return timetable.slice(*dateRange) if dateRange else timetable
+
+        try:
+            if not dateRange or self.activitiesCache.contains(semesterKey):
+                timetable = self.activitiesCache.get(semesterKey, lambda: getVPISActivities(location, semester))
+                return timetable.slice(*dateRange) if dateRange else timetable
+
+            firstDate, lastDate = dateRange
+            day = firstDate if firstDate == lastDate else None
+            return self.activitiesCache.get((locationName, semester, day, firstDate, lastDate),
+                                            lambda: getVPISActivities(location, semester, day, dateRange))
+        except (requests.RequestException, RuntimeError, ET.ParseError) as err:
+            timetable = self.snapshot.timetable(locationName, semester) if self.snapshot else None
+            if timetable is None:
+                raise
+            self.log.warning('VPIS failed ({}), answering from the snapshot of {}'.format(err, datetime.fromtimestamp(self.snapshot.createdAt).strftime('%Y-%m-%d %H:%M')))
+            metrics.count('snapshot.fallback')
+            return timetable.slice(*dateRange) if dateRange else timetable
+
+    def buildEntityFile(self, entityName, entries):
+        """Writes entries into the entity file entityName of every locale and registers it.
+
+        Files are only rewritten if the (sorted) entries changed and are kept between restarts, so
+        Padatious, which caches its training by file content, does not retrain unchanged entities.
+        If no entries could be fetched, the file of the last run is registered if there is one.
+        """
+
+        entries = sorted(set(entries))
+        changedLocales = []
+        for localeDir in listdir(join(self.root_dir, 'locale')):
+            entityFileName = join(self.root_dir, 'locale', localeDir, entityName)
+            if entries:
+                if writeEntityFile(entityFileName, entries):
+                    changedLocales.append(localeDir)
+            elif not exists(entityFileName):
+                self.log.error('No {} entries. Skill may not function properly!'.format(entityName))
+                return
+
+        if not entries:
+            self.log.warning('No {} entries fetched, using the entity file of the last run.'.format(entityName))
+        elif changedLocales:
+            self.log.info('Generated {} for {}'.format(entityName, ', '.join(changedLocales)))
+        else:
+            self.log.info('{} did not change'.format(entityName))
+        self.register_entity_file(entityName)
+
+    def getPrefetchInterval(self, now = None):
+        """Returns the prefetch interval in seconds, which is longer during PREFETCH_NIGHT_HOURS."""
+
+        hour = (now or datetime.now()).hour
+        nightBegin, nightEnd = PREFETCH_NIGHT_HOURS
+        if hour >= nightBegin or hour < nightEnd:
+            return self.settings.get('prefetchNightInterval', PREFETCH_NIGHT_INTERVAL)
+        return self.settings.get('prefetchInterval', PREFETCH_INTERVAL)
+
+    def prefetchNextLocation(self, message = None):
+        """Fetches the semester timetable of the next location (round robin) into activitiesCache.
+
+        Reschedules itself, so every location is refreshed once per prefetch interval
+        and requests to VPIS are spread evenly instead of firing all at once.
+        """
+
+        locations = list(fhswfLocationVpisShortKey)
+        locationName = locations[self.prefetchPosition % len(locations)]
+        self.prefetchPosition += 1
+        try:
+            self.activitiesCache.put((locationName, None, None, None, None), getVPISActivities(locationName.lower()))
+        except Exception as err:
+            self.log.warning('Prefetching activities of {} failed: {}'.format(locationName, err))
+        finally:
+            self.schedule_event(self.prefetchNextLocation, self.getPrefetchInterval() / len(locations), name = 'PrefetchActivities')
+
+    def exportMetrics(self, message = None):
+        """Logs a summary of the recorded metrics and writes them into the json file of setting metricsFile."""
+
+        summary = metrics.summary()
+        if summary:
+            self.log.info('Metrics since {}:\n{}'.format(datetime.fromtimestamp(metrics.startedAt).strftime('%Y-%m-%d %H:%M'), summary))
+        fileName = join(self.root_dir, self.settings.get('metricsFile', METRICS_FILE))
+        try:
+            makedirs(dirname(fileName), exist_ok = True)
+            metrics.writeJson(fileName)
+        except OSError as err:
+            self.log.warning('Could not write metrics: {}'.format(err))
+
+    def speak(self, utterance, expect_response = False, wait = False, meta = None):
+        with metrics.timer('speak'):
+            return super(FhSwfRoomQuerySkill, self).speak(utterance, expect_response = expect_response, wait = wait, meta = meta)
+
+    def composeResponse(self):
+        """Returns an empty ResponseComposer rendering the dialogs of this skill."""
+
+        return ResponseComposer(self.translate, self.settings.get('spokenItemsPerBatch', SPOKEN_ITEMS_PER_BATCH))
+
+    def speakComposed(self, composer):
+        """Speaks the utterances of composer, asking before each further batch whether to go on."""
+
+        for utterance, remaining in composer.utterances():
+            self.speak(utterance, wait = bool(remaining))
+            if remaining and self.ask_yesno('more.results.x', {'count': remaining}) != 'yes':
+                break
+
+    def matchSpokenName(self, matcher, spokenName, normalize):
+        """Returns the known name matching spokenName best.
+
+        If several names match equally well, the user is asked to choose one of them.
+        Without a (chosen) match normalize(spokenName) is returned.
+        """
+
+        candidates = matcher.candidates(spokenName)
+        if len(candidates) > 1:
+            metrics.count('match.ambiguous')
+            self.log.info("Ambiguous match for {}: {}".format(spokenName, candidates))
+            selected = self.ask_selection(candidates, 'which.one.do.you.mean.x', {'name': spokenName})
+            return selected or normalize(spokenName)
+        return candidates[0] if candidates else normalize(spokenName)
+
+    def queryResult(self, query, locationEntity):
+        """Returns the Timetable of a finished query or None after speaking why there is none."""
+
+        try:
+            return query.result(timeout = 0)
+        except Exception as err:
+            # besides network errors and timeouts eg. ET.ParseError of a broken VPIS document
+            self.log.warning('Could not get activities of {}: {}'.format(locationEntity, str(err) or 'timeout'))
+            self.speak_dialog('vpis.not.reachable')
+            return None
+
+    def submitQuery(self, location, dateRange = None):
+        """Starts getActivities for location and dateRange in queryExecutor and returns its future."""
+
+        return self.queryExecutor.submit(self.getActivities, location, dateRange = dateRange)
+
+    def queryLocation(self, locationEntity, queryString, dateRange):
+        """Starts fetching the activities of locationEntity for dateRange, asking for the location if needed.
+
+        While the user is asked for a missing or unknown location, the activities of the last queried
+        location are already fetched speculatively and reused if the user names that location again.
+
+        Returns
+        -------
+        query: tuple
+            (locationEntity, future) with future = None if the location is invalid.
+        """
+
+        speculativeQuery = None
+        if not locationEntity or locationEntity not in fhswfLocationMap:
+            if self.lastLocation:
+                speculativeQuery = self.submitQuery(self.lastLocation, dateRange)
+            self.log.info("Asking for another location")
+            locationEntity = self.get_response('please.tell.me.where.to.look.for.x', {'queryString': queryString})
+            self.log.info("New location:{}".format(locationEntity))
+
+        if not locationEntity or locationEntity not in fhswfLocationMap:
+            future = None
+        elif speculativeQuery and fhswfLocationMap[locationEntity] == fhswfLocationMap[self.lastLocation]:
+            metrics.count('query.speculativeHit')
+            future = speculativeQuery
+            speculativeQuery = None
+        else:
+            future = self.submitQuery(locationEntity, dateRange)
+            self.lastLocation = locationEntity
+        if speculativeQuery:
+            speculativeQuery.cancel()
+        return locationEntity, future
+
+    def respond(self, futures, answer, timeout = None):
+        """Calls answer once futures are done, without blocking the intent handler longer than the acknowledge deadline.
+
+        If futures are done within the deadline, answer is called right away and its return value returned.
+        Otherwise the query is acknowledged, answer is called from a background thread once futures are done
+        (or timeout seconds after the query started, defaults to QUERY_TIMEOUT) and 0 is returned. So answer
+        has to expect futures, which are not done yet. stop() cancels pending answers. On both paths
+        query.failed is spoken if answer raises.
+        """
+
+        startedAt = time.monotonic()
+        deadline = self.settings.get('acknowledgeDeadline', ACKNOWLEDGE_DEADLINE)
+        timeout = timeout or self.settings.get('queryTimeout', QUERY_TIMEOUT)
+        if not wait(futures, timeout = min(deadline, timeout)).not_done:
+            return self.answerQuery(answer)
+
+        metrics.count('query.acknowledged')
+        self.speak_dialog('one.moment.please')
+        with self.queryLock:
+            generation = self.queryGeneration
+            self.pendingQueries.update(futures)
+
+        def answerLater():
+            wait(futures, timeout = max(0, timeout - (time.monotonic() - startedAt)))
+            with self.queryLock:
+                self.pendingQueries.difference_update(futures)
+                if generation != self.queryGeneration:
+                    return
+            self.answerQuery(answer)
+
+        threading.Thread(target = answerLater, daemon = True).start()
+        return 0
+
+    def answerQuery(self, answer):
+        """Calls answer and returns its return value, speaking query.failed instead of staying silent if it raises."""
+
+        try:
+            return answer()
+        except Exception as err:
+            self.log.error('Answering the query failed: {}'.format(err))
+            self.speak_dialog('query.failed')
+            return 1
+
     # intents for information about how to use this skill
     @intent_handler('tell.me.about.this.skill.intent')
     def tellMeAboutThisSkill(self, message):
@@ -394,6 +2357,7 @@ class FhSwfRoomQuerySkill(MycroftSkill):
 
     # query for a room
     @intent_handler('what.does.take.place.in.room.x.intent')
+    @metrics.timed('intent.whatDoesTakePlaceIn')
     def handleWhatDoesTakePlaceIn(self, message):
         """Handles the query for occupancy of a room.
         """
@@ -403,46 +2367,47 @@ class FhSwfRoomQuerySkill(MycroftSkill):
         locationEntity = message.data.get('location')
         dayEntity = message.data.get('day')
 
-        if not locationEntity or locationEntity not in fhswfLocationMap:
-            self.log.info("Asking for another location")
-            locationEntity = self.get_response('please.tell.me.where.to.look.for.x', {'queryString': roomEntity})
-            self.log.info("New location:{}".format(locationEntity))
-        
-        if not dayEntity:
-            dayEntity = str(date.today().isoformat())
-            self.log.info("Set date to todays date:{}".format(dayEntity))
-        
-        try:    
-            occupiedRooms, courses = getVPISActivities(locationEntity)
-        except AttributeError as err:
-            self.speak_dialog('invalid.location', {'location': locationEntity})
+        dateRange = resolveDay(dayEntity)
+        if not dateRange:
+            self.speak_dialog('invalid.day', {'day': dayEntity})
             return 1
+        self.log.info("Resolved day \"{}\" to {}".format(dayEntity, dateRange))
 
-        if not occupiedRooms:
-            self.log.info("Query Failed line 280")
-            self.speak_dialog('room.not.found', {'room': roomEntity})
-            return 1
-        elif not courses:
-            self.log.info("Query Failed line 284")
-            self.speak_dialog('course.not.found')
+        locationEntity, query = self.queryLocation(locationEntity, roomEntity, dateRange)
+        if not query:
+            self.speak_dialog('invalid.location', {'location': locationEntity})
             return 1
-        self.log.info("\"{}\" remove spaces ===> \"{}\"".format(roomEntity, roomEntity.replace(' ', '')))
-        roomEntity = roomEntity.replace(' ', '')
-        self.log.info(roomEntity)
-
-        if roomEntity in occupiedRooms:
-            self.speak_dialog('following.courses.take.place.in.room.x', {'room': roomEntity})
-            for courseTimeBegin in occupiedRooms[roomEntity][dayEntity]:
-                for courseName in occupiedRooms[roomEntity][dayEntity][courseTimeBegin]:
-                    self.speak_dialog('course.x.takes.place.in.room.y', {'time':courseTimeBegin, 'course': courseName, 'courseType': occupiedRooms[roomEntity][dayEntity][courseTimeBegin][courseName]['type'], 'courseEndTime':occupiedRooms[roomEntity][dayEntity][courseTimeBegin][courseName]['end']})
-        else:
-            self.log.info("Query Failed line 299")
-            self.speak_dialog('room.not.found', {'room': roomEntity})
-        
-        return 0
+
+        def answer():
+            timetable = self.queryResult(query, locationEntity)
+            if timetable is None:
+                return 1
+            if not timetable:
+                self.log.info("Query Failed: no activities for {}".format(dateRange))
+                self.speak_dialog('room.not.found', {'room': roomEntity})
+                return 1
+            roomMatcher = self.roomMatchersByLocation.get(fhswfLocationMap[locationEntity], self.roomMatcher)
+            room = self.matchSpokenName(roomMatcher, roomEntity, normalizeRoomString)
+            self.log.info("Matched room: {}".format(room))
+
+            slots = groupSlots(timetable.slotsInRoom(room))
+            if not slots:
+                self.log.info("Query Failed: no activities in {}".format(room))
+                self.speak_dialog('room.not.found', {'room': room})
+                return 1
+            response = self.composeResponse()
+            response.setIntro('following.courses.take.place.in.room.x', {'room': room})
+            for slot in slots:
+                headings = [('on.day.x', {'day': formatDay(slot.date)})] if dateRange[0] != dateRange[1] else []
+                response.add('course.x.takes.place.in.room.y', {'time': slot.begin, 'course': slot.course, 'courseType': slot.type, 'courseEndTime': slot.end}, headings)
+            self.speakComposed(response)
+            return 0
+
+        return self.respond([query], answer)
 
     # query for a course
     @intent_handler('where.does.course.x.take.place.intent')
+    @metrics.timed('intent.whereDoesCourseTakePlace')
     def handleWhereDoesCourseTakePlace(self, message):
         """Handles queries about where a course takes place.
         """
@@ -451,67 +2416,196 @@ class FhSwfRoomQuerySkill(MycroftSkill):
         courseEntity = message.data.get('course')
         locationEntity = message.data.get('location')
         dayEntity = message.data.get('day')
-        
-        if not locationEntity or locationEntity not in fhswfLocationMap:
-            self.log.info("Asking for another location")
-            locationEntity = self.get_response('please.tell.me.where.to.look.for.x', {'queryString': courseEntity})
-            self.log.info("New location:{}".format(locationEntity))
 
-        if not dayEntity:
-            dayEntity = str(date.today().isoformat())
-            self.log.info("Set date to todays date:{}".format(dayEntity))
+        dateRange = resolveDay(dayEntity)
+        if not dateRange:
+            self.speak_dialog('invalid.day', {'day': dayEntity})
+            return 1
+        self.log.info("Resolved day \"{}\" to {}".format(dayEntity, dateRange))
 
-        try:    
-            occupiedRooms, courses = getVPISActivities(locationEntity)
-        except AttributeError as err:
+        locationEntity, query = self.queryLocation(locationEntity, courseEntity, dateRange)
+        if not query:
             self.speak_dialog('invalid.location', {'location': locationEntity})
             return 1
+        course = self.matchSpokenName(self.courseMatcher, courseEntity, normalizeCourseString)
+        self.log.info("Matched course: {}".format(course))
+
+        def answer():
+            timetable = self.queryResult(query, locationEntity)
+            if timetable is None:
+                return 1
+            slots = groupSlots(timetable.slotsOfCourse(course)) if timetable else []
+            if not slots:
+                self.speak_dialog('no.courses.for.location.x', {'course': course, 'location': locationEntity})
+                return 1
 
-        if not occupiedRooms and not courses:
-            self.speak_dialog('no.courses.for.location.x', {'course': courseEntity, 'location': locationEntity})
+            slotsByRoom = OrderedDict()
+            for slot in slots:
+                slotsByRoom.setdefault(slot.room, []).append(slot)
+            response = self.composeResponse()
+            for room, roomSlots in slotsByRoom.items():
+                self.log.info({'room': room, 'location': locationEntity, 'course': course})
+                for slot in roomSlots:
+                    headings = [('course.x.takes.place.in.following.rooms', {'room': room, 'location': locationEntity})]
+                    if dateRange[0] != dateRange[1]:
+                        headings.append(('on.day.x', {'day': formatDay(slot.date)}))
+                    response.add('course.x.takes.place.in.room.y', {'time': slot.begin, 'course': course, 'courseType': slot.type, 'courseEndTime': slot.end}, headings)
+            self.speakComposed(response)
+            return 0
+
+        return self.respond([query], answer)
+
+    # query for a free room
+    @intent_handler('find.free.room.intent')
+    @metrics.timed('intent.findFreeRoom')
+    def handleFindFreeRoom(self, message):
+        """Handles queries for a free room right now, at one location or at every location.
+        """
+
+        self.log.info(message.serialize())
+        locationEntity = message.data.get('location')
+        hours = parseSpokenNumber(message.data.get('hours'))
+
+        if locationEntity and locationEntity not in fhswfLocationMap:
+            self.speak_dialog('invalid.location', {'location': locationEntity})
             return 1
-        
-        self.log.info('normalizeCourseString("{}")'.format(courseEntity))
-        courseEntity = normalizeCourseString(courseEntity)
-        self.log.info(courseEntity)
-        
-        if courseEntity in courses:
-            if dayEntity in courses[courseEntity]:
-                for room in courses[courseEntity][dayEntity]:
-                    self.log.info({'room': room, 'location': locationEntity, 'course': courseEntity})
-                    self.speak_dialog('course.x.takes.place.in.following.rooms', {'room': room, 'location': locationEntity})
-                    for time in courses[courseEntity][dayEntity][room]:
-                        self.log.info({'time': time, 'courseType': courses[courseEntity][dayEntity][room][time]['type'], 'courseEndTime': courses[courseEntity][dayEntity][room][time]['end']})
-                        self.speak_dialog('course.x.takes.place.in.room.y', {'time': time, 'course': courseEntity, 'courseType': courses[courseEntity][dayEntity][room][time]['type'], 'courseEndTime': courses[courseEntity][dayEntity][room][time]['end']})
-        else:
-            self.speak_dialog('no.courses.for.location.x', {'course': courseEntity, 'location': locationEntity})
-        
-        return 0
+        locationNames = [fhswfLocationMap[locationEntity]] if locationEntity else list(fhswfLocationVpisShortKey)
+
+        now = datetime.now()
+        minutes = hours * 60 if hours else self.settings.get('freeRoomDefaultMinutes', FREE_ROOM_DEFAULT_MINUTES)
+        begin = now.strftime('%H:%M')
+        end = min(now + timedelta(minutes = minutes), now.replace(hour = 23, minute = 59)).strftime('%H:%M')
+        today = now.date().isoformat()
+
+        # fetch every location concurrently and answer with whatever arrived within the time budget
+        futures = {self.submitQuery(locationName.lower(), (today, today)): locationName for locationName in locationNames}
+
+        def answer():
+            done, notDone = wait(futures, timeout = 0)
+            if notDone:
+                self.log.warning('Skipping locations which did not answer in time: {}'.format(', '.join(futures[future] for future in notDone)))
+
+            foundFreeRoom = False
+            evaluatedLocations = 0
+            for future, locationName in futures.items():
+                if future not in done:
+                    continue
+                try:
+                    timetable = future.result()
+                except Exception as err:
+                    self.log.warning('Could not get activities of {}: {}'.format(locationName, err))
+                    continue
+                evaluatedLocations += 1
+                freeRooms = findFreeRooms(timetable, self.roomsByLocation.get(locationName, ()), today, begin, end)
+                if freeRooms:
+                    foundFreeRoom = True
+                    self.speak_dialog('free.rooms.in.location.x', {'location': locationName, 'rooms': joinSpoken(room for room, _ in freeRooms[:FREE_ROOM_MAX_SPOKEN])})
+
+            if not evaluatedLocations:
+                # without any timetable nothing can be said about free rooms
+                self.speak_dialog('vpis.not.reachable')
+                return 1
+            if not foundFreeRoom:
+                self.speak_dialog('no.free.room.found', {'end': end})
+                return 1
+            return 0
+
+        return self.respond(list(futures), answer, FREE_ROOM_QUERY_TIMEOUT)
 
     # query for when a course takes place
     @intent_handler('when.does.course.x.take.place.intent')
+    @metrics.timed('intent.whenDoesCourseTakePlace')
     def handleWhenDoesCourseTakePlace(self, message):
-        """TODO implement functionality to answer a time.
-        Until implementation, speaks a sentence that it is not implemented yet.
+        """Handles queries about when a course takes place.
+
+        Without a day, the next occurrences from now are spoken, otherwise the occurrences on that day.
+        Without a location, every location is searched.
         """
-        self.speak_dialog('not.implemented.yet')
 
-    def shutdown(self):
+        self.log.info(message.serialize())
+        courseEntity = message.data.get('course')
+        locationEntity = message.data.get('location')
+        dayEntity = message.data.get('day')
 
- #       try:
-        for localeDir in listdir(join(self.root_dir, 'locale')):
-            roomEntityFile = join(self.root_dir, 'locale', localeDir, 'room.entity')
-            courseEntityFile = join(self.root_dir, 'locale', localeDir, 'course.entity')
-            if exists(roomEntityFile):
-                remove(roomEntityFile)
+        if locationEntity and locationEntity not in fhswfLocationMap:
+            self.speak_dialog('invalid.location', {'location': locationEntity})
+            return 1
+        locationNames = [fhswfLocationMap[locationEntity]] if locationEntity else list(fhswfLocationVpisShortKey)
+
+        dateRange = resolveDay(dayEntity) if dayEntity else None
+        if dayEntity and not dateRange:
+            self.speak_dialog('invalid.day', {'day': dayEntity})
+            return 1
+
+        # the timetables are fetched while the user may be asked which course was meant
+        futures = {self.submitQuery(locationName.lower(), dateRange): locationName for locationName in locationNames}
+
+        courseEntity = self.matchSpokenName(self.courseMatcher, courseEntity, normalizeCourseString)
+        self.log.info("Matched course: {}".format(courseEntity))
 
-            if exists(courseEntityFile):
-                remove(courseEntityFile)
-#       except Exception as e:
-#           self.log.error("Could not delete entity files.")
+        def answer():
+            done, notDone = wait(futures, timeout = 0)
+            if notDone:
+                self.log.warning('Skipping locations which did not answer in time: {}'.format(', '.join(futures[future] for future in notDone)))
+
+            now = datetime.now().strftime('%Y-%m-%d %H:%M')
+            occurrences = []
+            evaluatedLocations = 0
+            for future in done:
+                try:
+                    timetable = future.result()
+                except Exception as err:
+                    self.log.warning('Could not get activities of {}: {}'.format(futures[future], err))
+                    continue
+                evaluatedLocations += 1
+                slots = timetable.slotsOfCourse(courseEntity) if dateRange else timetable.nextOccurrences(courseEntity, now, NEXT_OCCURRENCES_SPOKEN)
+                occurrences.extend((slot, futures[future]) for slot in groupSlots(slots))
+
+            if not evaluatedLocations:
+                self.speak_dialog('vpis.not.reachable')
+                return 1
+            if not occurrences:
+                self.speak_dialog('no.courses.for.location.x', {'course': courseEntity, 'location': locationEntity or joinSpoken(locationNames, 'oder')})
+                return 1
+
+            occurrences.sort(key = lambda occurrence: (occurrence[0].date, occurrence[0].begin))
+            if not dateRange:
+                occurrences = occurrences[:NEXT_OCCURRENCES_SPOKEN]
+            response = self.composeResponse()
+            for slot, locationName in occurrences:
+                response.add('course.x.takes.place.on.day.y', {'course': courseEntity, 'courseType': slot.type, 'day': formatDay(slot.date),
+                                                               'time': slot.begin, 'courseEndTime': slot.end, 'room': slot.room, 'location': locationName})
+            self.speakComposed(response)
+            return 0
+
+        return self.respond(list(futures), answer, FREE_ROOM_QUERY_TIMEOUT)
+
+    def shutdown(self):
+        # room.entity and course.entity are kept, so the next start only rewrites them if VPIS changed
+        self.cancel_scheduled_event('PrefetchActivities')
+        self.stop()
+        if metrics.enabled:
+            self.cancel_scheduled_event('ExportMetrics')
+            self.exportMetrics()
+        if self.metricsServer:
+            self.metricsServer.close()
+        self.queryExecutor.shutdown(wait = False)
+        vpisClient.close()
+        if self.snapshot:
+            self.snapshot.close()
 
     def stop(self):
-        pass
+        """Cancels every query, which was acknowledged but not answered yet."""
+
+        with self.queryLock:
+            pendingQueries = list(self.pendingQueries)
+            self.pendingQueries.clear()
+            self.queryGeneration += 1
+        for future in pendingQueries:
+            future.cancel()
+        if pendingQueries:
+            metrics.count('query.cancelled')
+        return bool(pendingQueries)
 
 def create_skill():
     return FhSwfRoomQuerySkill()
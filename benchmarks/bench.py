@@ -0,0 +1,296 @@
+"""Offline benchmarks for the FH-SWF Raumbelegung skill.
+
+Replays the VPIS documents (control XML, location/activities XML and the faecherangebotplanung.php3 HTML)
+from local fixtures or from synthetic generators through a mocked transport, which is mounted on the
+shared VpisClient session. Nothing is sent to vpis.fh-swf.de.
+
+Reports parse times, peak memory and the end-to-end latency of every intent handler.
+
+Loads the skill with tools/skillloader.py, see there which python to run it with, eg.:
+
+    mycroft-venv/bin/python benchmarks/bench.py
+    mycroft-venv/bin/python benchmarks/bench.py --synthetic --rooms 400 --courses 1500 --weeks 16
+    mycroft-venv/bin/python benchmarks/bench.py --synthetic --json bench_output.json
+"""
+
+import argparse
+import gc
+import io
+import json
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from os.path import abspath, dirname, join
+from urllib.parse import urlparse
+from xml.sax.saxutils import escape
+
+import requests
+from requests.adapters import BaseAdapter
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'tools'))
+from skillloader import SKILL_DIR, loadSkillModule
+
+FIXTURES_DIR = join(dirname(abspath(__file__)), 'fixtures')
+
+# synthetic VPIS documents #
+
+def generateActivitiesXml(locationKey, rooms = 50, courses = 200, weeks = 14, firstDay = None, seed = 0):
+    """Generates an activities XML of a location like VPIS delivers it for a whole semester.
+
+    Every course takes place once a week in one or two rooms, so the XML contains
+    courses * weeks activity dates spread over all rooms.
+    """
+
+    rnd = random.Random(seed)
+    firstDay = firstDay or date.today() - timedelta(days = date.today().weekday() + 7 * (weeks // 2))
+    roomNames = ['{}-{}{:03d}'.format(locationKey, rnd.choice('ABHZ'), number) for number in range(rooms)]
+    begins = [('08:00', '09:30'), ('09:45', '11:15'), ('12:00', '13:30'), ('14:15', '15:45'), ('16:00', '17:30')]
+    types = ['Vorlesung', 'Übung', 'Praktikum', 'Seminar']
+
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<vpis>\n<locations>\n']
+    parts.extend('<location><name>{}</name></location>\n'.format(roomName) for roomName in roomNames)
+    parts.append('</locations>\n<activities>\n')
+    for course in range(courses):
+        weekday = rnd.randrange(5)
+        begin, end = rnd.choice(begins)
+        parts.append('<activity><name>{}</name><activity-type>{}</activity-type><activity-dates>'.format(escape(syntheticCourseName(course)), rnd.choice(types)))
+        for week in range(weeks):
+            courseDate = (firstDay + timedelta(days = 7 * week + weekday)).isoformat()
+            parts.append('<activity-date date="{}" begin="{}" end="{}"/>'.format(courseDate, begin, end))
+        parts.append('</activity-dates><activity-locations>')
+        for roomName in rnd.sample(roomNames, min(len(roomNames), rnd.choice((1, 1, 2)))):
+            parts.append('<activity-location>{}</activity-location>'.format(roomName))
+        parts.append('</activity-locations></activity>\n')
+    parts.append('</activities>\n</vpis>\n')
+    return ''.join(parts).encode('utf-8')
+
+def generateCoursesHtml(courses = 200):
+    """Generates a faecherangebotplanung.php3 page listing courses like VPIS does."""
+
+    rows = ''.join('<tr><td><a href="fach.php3?id={0}"><span style="white-space:nowrap;">{1}</span></a></td>'
+                   '<td>Prof. Dr. Muster</td><td>V, Ü</td></tr>\n'.format(course, escape(syntheticCourseName(course)))
+                   for course in range(courses))
+    return ('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">\n<html><head><title>Fächerangebot</title></head>'
+            '<body><table class="liste">\n' + rows + '</table></body></html>\n').encode('utf-8')
+
+def syntheticCourseName(course):
+    subjects = ['Programmierung', 'Mathematik', 'Elektrotechnik', 'Datenbanken', 'Netzwerke', 'Regelungstechnik',
+                'Betriebssysteme', 'Physik', 'Werkstoffkunde', 'Konstruktion', 'Marketing', 'Controlling']
+    suffixes = ['', ' (Projekt)', ' / Labor', ' & Übung', ': Grundlagen', ' - Vertiefung']
+    return '{} {}{}'.format(subjects[course % len(subjects)], course // len(subjects) + 1, suffixes[course % len(suffixes)])
+
+# mocked transport #
+
+class FixtureAdapter(BaseAdapter):
+    """requests transport adapter answering every VPIS url from local documents.
+
+    The control document points every location to /fixtures/<key>, which redirects to the
+    location's activities, just like the short urls of the real control document.
+    """
+
+    def __init__(self, controlXml, activitiesByLocation, coursesHtml):
+        super().__init__()
+        self.controlXml = controlXml
+        self.activitiesByLocation = activitiesByLocation
+        self.coursesHtml = coursesHtml
+        self.requests = 0
+        self.bytes = 0
+
+    def send(self, request, stream = False, timeout = None, verify = True, cert = None, proxies = None):
+        self.requests += 1
+        path = urlparse(request.url).path
+        if path == '/vpisapp.php':
+            return self.respond(request, 200, self.controlXml, 'application/xml')
+        elif path.startswith('/fixtures/'):
+            locationKey = path.rsplit('/', 1)[-1]
+            return self.respond(request, 302, b'', 'text/html', {'Location': 'https://vpis.fh-swf.de/SS2021/vpisapp.php3?Fachbereich=' + locationKey})
+        elif path.endswith('/vpisapp.php3'):
+            locationKey = request.url.split('Fachbereich=')[1][:2]
+            return self.respond(request, 200, self.activitiesByLocation[locationKey], 'application/xml')
+        elif path.endswith('/faecherangebotplanung.php3'):
+            return self.respond(request, 200, self.coursesHtml, 'text/html; charset=utf-8')
+        return self.respond(request, 404, b'', 'text/html')
+
+    def respond(self, request, status, body, contentType, headers = None):
+        self.bytes += len(body)
+        response = requests.Response()
+        response.status_code = status
+        response.headers['Content-Type'] = contentType
+        response.headers.update(headers or {})
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        return response
+
+    def close(self):
+        pass
+
+def controlXml(locationKeys):
+    names = {'Is': 'Iserlohn', 'Ha': 'Hagen', 'Ls': 'Lüdenscheid', 'Me': 'Meschede', 'So': 'Soest'}
+    locations = ''.join('<locations href="https://vpis.fh-swf.de/fixtures/{}">{}</locations>\n'.format(key, names[key]) for key in locationKeys)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<vpis>\n' + locations + '</vpis>\n').encode('utf-8')
+
+def buildAdapter(arguments):
+    locationKeys = ['Is', 'Ha', 'Ls', 'Me', 'So']
+    if arguments.synthetic:
+        activities = {key: generateActivitiesXml(key, arguments.rooms, arguments.courses, arguments.weeks, seed = index)
+                      for index, key in enumerate(locationKeys)}
+        return FixtureAdapter(controlXml(locationKeys), activities, generateCoursesHtml(arguments.courses))
+
+    with open(join(FIXTURES_DIR, 'activities.xml'), 'rb') as fixture:
+        activitiesXml = fixture.read()
+    with open(join(FIXTURES_DIR, 'faecherangebotplanung.html'), 'rb') as fixture:
+        coursesHtml = fixture.read()
+    with open(join(FIXTURES_DIR, 'vpisapp.xml'), 'rb') as fixture:
+        control = fixture.read()
+    return FixtureAdapter(control, {key: activitiesXml.replace(b'>Is-', ('>' + key + '-').encode()) for key in locationKeys}, coursesHtml)
+
+# measuring #
+
+def measure(name, function, repeat, results, reset = None):
+    """Runs function repeat times (calling reset before each run) and records wall time and peak memory."""
+
+    timings = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        gc.collect()
+        begin = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - begin)
+
+    if reset:
+        reset()
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results[name] = {'min_ms': min(timings) * 1000, 'median_ms': statistics.median(timings) * 1000, 'peak_kib': peak / 1024}
+    print('{:<45} min {:>9.2f} ms   median {:>9.2f} ms   peak {:>10.1f} KiB'.format(name, results[name]['min_ms'], results[name]['median_ms'], results[name]['peak_kib']))
+
+def benchmarkSkill(skill, adapter, arguments, results):
+    """Measures initialize() and the end-to-end latency of every intent handler with a cold and a warm cache."""
+
+    from mycroft.messagebus.message import Message
+
+    class BenchmarkSkill(skill.FhSwfRoomQuerySkill):
+        # everything talking to the message bus only records what would have been sent
+        def register_entity_file(self, entityFile):
+            pass
+
+        def schedule_event(self, *args, **kwargs):
+            pass
+
+        def cancel_scheduled_event(self, *args, **kwargs):
+            pass
+
+        def speak_dialog(self, key, data = None, expect_response = False, wait = False):
+            self.spoken.append(key)
+
+        def speak(self, utterance, expect_response = False, wait = False, meta = None):
+            self.spoken.append(utterance)
+
+        def translate(self, text, data = None):
+            return text
+
+        def ask_yesno(self, prompt, data = None):
+            return 'yes'
+
+        def ask_selection(self, options, dialog = '', data = None, min_conf = 0.65, numeric = False):
+            return options[0]
+
+        def get_response(self, *args, **kwargs):
+            return 'iserlohn'
+
+    rootDir = tempfile.mkdtemp(prefix = 'fhswf-bench-')
+    shutil.copytree(join(SKILL_DIR, 'locale'), join(rootDir, 'locale'))
+    try:
+        instance = BenchmarkSkill()
+        instance.root_dir = rootDir
+        instance.spoken = []
+
+        def reset():
+            skill.vpisClient.clearValidated()
+            skill.vpisLocationResolver.invalidate()
+
+        measure('initialize()', instance.initialize, arguments.repeat, results, reset)
+
+        room = sorted(instance.roomsByLocation.get('Iserlohn', ['h409']))[0]
+        course = sorted(instance.coursesByLocation.get('Is', ['programmierung mit c++2']))[0]
+        intents = [
+            ('what.does.take.place.in.room.x', instance.handleWhatDoesTakePlaceIn, {'room': room, 'location': 'iserlohn'}),
+            ('what.does.take.place.in.room.x (week)', instance.handleWhatDoesTakePlaceIn, {'room': room, 'location': 'iserlohn', 'day': 'diese woche'}),
+            ('where.does.course.x.take.place', instance.handleWhereDoesCourseTakePlace, {'course': course, 'location': 'iserlohn'}),
+            ('when.does.course.x.take.place', instance.handleWhenDoesCourseTakePlace, {'course': course}),
+            ('find.free.room', instance.handleFindFreeRoom, {}),
+        ]
+        for name, handler, data in intents:
+            message = Message('recognizer_loop:utterance', data)
+
+            def coldCache():
+                reset()
+                instance.activitiesCache.clear()
+
+            measure('intent {} (cold)'.format(name), lambda: handler(message), arguments.repeat, results, coldCache)
+            measure('intent {} (warm)'.format(name), lambda: handler(message), arguments.repeat, results)
+        instance.shutdown()
+    finally:
+        shutil.rmtree(rootDir, ignore_errors = True)
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    parser.add_argument('--synthetic', action = 'store_true', help = 'use generated documents instead of the fixtures')
+    parser.add_argument('--rooms', type = int, default = 100, help = 'synthetic rooms per location')
+    parser.add_argument('--courses', type = int, default = 400, help = 'synthetic courses per location')
+    parser.add_argument('--weeks', type = int, default = 14, help = 'synthetic weeks per semester')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'runs per measurement')
+    parser.add_argument('--no-intents', action = 'store_true', help = 'skip the skill and intent handler benchmarks')
+    parser.add_argument('--json', help = 'write the results as JSON into this file')
+    arguments = parser.parse_args()
+
+    skill = loadSkillModule()
+    adapter = buildAdapter(arguments)
+    skill.vpisClient.session.mount('https://', adapter)
+    skill.vpisClient.session.mount('http://', adapter)
+
+    activitiesXml = adapter.activitiesByLocation['Is']
+    print('activities XML: {:.1f} KiB, courses HTML: {:.1f} KiB'.format(len(activitiesXml) / 1024, len(adapter.coursesHtml) / 1024))
+
+    def reset():
+        skill.vpisClient.clearValidated()
+        skill.vpisLocationResolver.invalidate()
+
+    results = {}
+    courseNames = [syntheticCourseName(course) for course in range(arguments.courses)]
+    measure('normalizeCourseString() x {}'.format(len(courseNames)), lambda: [skill.normalizeCourseString(name) for name in courseNames], arguments.repeat, results)
+    measure('parseVPISActivities()', lambda: skill.parseVPISActivities(activitiesXml), arguments.repeat, results)
+    measure('getVPISActivities()', lambda: skill.getVPISActivities('iserlohn'), arguments.repeat, results, reset)
+    measure('getVPISActivities() single day', lambda: skill.getVPISActivities('iserlohn', dateRange = (date.today().isoformat(),) * 2), arguments.repeat, results, reset)
+    measure('getRoomsByLocation()', skill.getRoomsByLocation, arguments.repeat, results, reset)
+    coursesHtml = adapter.coursesHtml.decode('utf-8')
+    measure('extractCourseNames()', lambda: skill.extractCourseNames(coursesHtml), arguments.repeat, results)
+    measure('getCoursesByLocation()', skill.getCoursesByLocation, arguments.repeat, results, reset)
+
+    if not arguments.no_intents:
+        benchmarkSkill(skill, adapter, arguments, results)
+
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform == 'darwin' else 1)
+    print('peak RSS of the whole run: {:.1f} MiB, {} requests, {:.1f} MiB served'.format(peakRss / 1024, adapter.requests, adapter.bytes / 1024 / 1024))
+    results['peak_rss_kib'] = peakRss
+
+    if arguments.json:
+        with open(arguments.json, 'w') as output:
+            json.dump(results, output, indent = 2)
+
+if __name__ == '__main__':
+    main()
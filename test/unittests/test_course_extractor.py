@@ -0,0 +1,65 @@
+"""Checks that extractCourseNames returns exactly what the former BeautifulSoup based scraping returned.
+
+Loads the skill with tools/skillloader.py, see there which python to run it with (bs4 is listed in
+requirements.txt, lxml is optional):
+
+    mycroft-venv/bin/python -m unittest discover -s test/unittests
+"""
+
+import sys
+import unittest
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, join(dirname(dirname(dirname(abspath(__file__)))), 'tools'))
+from skillloader import SKILL_DIR, loadSkillModule
+
+FIXTURES_DIR = join(SKILL_DIR, 'benchmarks', 'fixtures')
+
+def readFixture(fileName):
+    with open(join(FIXTURES_DIR, fileName), encoding = 'utf-8') as fixture:
+        return fixture.read()
+
+class CourseExtractorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            import mycroft
+            from bs4 import BeautifulSoup
+        except ImportError as err:
+            raise unittest.SkipTest('needs mycroft and bs4: {}'.format(err))
+        cls.skill = loadSkillModule()
+        cls.BeautifulSoup = BeautifulSoup
+        cls.parsers = ['html.parser']
+        try:
+            import lxml
+            cls.parsers.append('lxml')
+        except ImportError:
+            pass
+
+    def assertMatchesBeautifulSoup(self, html):
+        extracted = self.skill.extractCourseNames(html)
+        for parser in self.parsers:
+            with self.subTest(parser = parser):
+                courseTags = self.BeautifulSoup(html, parser).find_all('span', {'style': 'white-space:nowrap;'})
+                self.assertEqual(extracted, [self.skill.normalizeCourseString(str(courseTag.text)) for courseTag in courseTags])
+
+    def testCoursePageFixture(self):
+        self.assertMatchesBeautifulSoup(readFixture('faecherangebotplanung.html'))
+
+    def testEdgeCases(self):
+        self.assertMatchesBeautifulSoup(readFixture('course_edge_cases.html'))
+
+    def testUnclosedSpanEndsWithEnclosingCell(self):
+        html = '<table><tr><td><span style="white-space:nowrap;">Mathe 1</td><td>Prof X</td></tr>' \
+               '<tr><td><span style="white-space:nowrap;">Physik</td><td>Dr Y</td></tr></table>'
+        self.assertEqual(self.skill.extractCourseNames(html), ['mathe 1', 'physik'])
+        self.assertMatchesBeautifulSoup(html)
+
+    def testChunkedInput(self):
+        html = readFixture('course_edge_cases.html')
+        self.assertEqual(self.skill.extractCourseNames(html[position:position + 7] for position in range(0, len(html), 7)),
+                         self.skill.extractCourseNames(html))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+"""Loads the FH-SWF Raumbelegung skill outside of Mycroft, for the benchmarks, the tests and tools/snapshot.py.
+
+The skill imports mycroft, so everything using this module has to run with the python of your
+Mycroft installation, eg.:
+
+    mycroft-venv/bin/python benchmarks/bench.py
+"""
+
+import importlib.util
+import sys
+from os.path import abspath, dirname, join
+
+SKILL_DIR = dirname(dirname(abspath(__file__)))
+
+def loadSkillModule():
+    """Imports the skill's __init__.py the same way Mycroft does (as package of the skill directory)."""
+
+    spec = importlib.util.spec_from_file_location('fhswf_raumbelegung_skill', join(SKILL_DIR, '__init__.py'),
+                                                  submodule_search_locations = [SKILL_DIR])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,66 @@
+"""Builds and inspects snapshots of the FH-SWF Raumbelegung skill.
+
+A snapshot holds the timetables of every location (current semester and optionally further semesters),
+the rooms and the courses in one compact binary file. Build it once and copy it into the skill directory
+of every device (as snapshot.bin or the file of the skill setting snapshotFile), so the devices start
+without downloading the semesters themselves and keep answering while VPIS is not reachable.
+
+Loads the skill with tools/skillloader.py, see there which python to run it with, eg.:
+
+    mycroft-venv/bin/python tools/snapshot.py build snapshot.bin
+    mycroft-venv/bin/python tools/snapshot.py build snapshot.bin --semesters SS2021 WS2021
+    mycroft-venv/bin/python tools/snapshot.py info snapshot.bin
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+from os.path import getsize
+
+from skillloader import loadSkillModule
+
+def build(skill, arguments):
+    errors = []
+    begin = time.perf_counter()
+    timetables = skill.buildSnapshot(arguments.file, arguments.semesters, errors)
+    for error in errors:
+        print('failed: ' + error, file = sys.stderr)
+    print('wrote {} timetables with {} slots into {} ({:.1f} KiB) in {:.1f} s'.format(
+        len(timetables), sum(map(len, timetables.values())), arguments.file, getsize(arguments.file) / 1024, time.perf_counter() - begin))
+    return 1 if errors and arguments.strict else 0
+
+def info(skill, arguments):
+    begin = time.perf_counter()
+    snapshot = skill.Snapshot(arguments.file)
+    opened = time.perf_counter() - begin
+    print('{}: created {}, {} strings, opened in {:.2f} ms'.format(
+        arguments.file, datetime.fromtimestamp(snapshot.createdAt).strftime('%Y-%m-%d %H:%M'), len(snapshot.strings), opened * 1000))
+    for locationName, semester in sorted(snapshot.timetableKeys(), key = lambda key: (key[0], key[1] or '')):
+        timetable = snapshot.timetable(locationName, semester)
+        dates = sorted(timetable.dates())
+        print('  {:<12} {:<16} {:>7} slots  {} - {}'.format(locationName, semester or 'current semester', len(timetable),
+                                                             dates[0] if dates else '-', dates[-1] if dates else '-'))
+    rooms = snapshot.roomsByLocation()
+    courses = snapshot.coursesByLocation()
+    print('  rooms:   ' + ', '.join('{} {}'.format(key, len(values)) for key, values in sorted(rooms.items())))
+    print('  courses: ' + ', '.join('{} {}'.format(key, len(values)) for key, values in sorted(courses.items())))
+    snapshot.close()
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    buildParser = commands.add_parser('build', help = 'fetch everything from VPIS and write a snapshot')
+    buildParser.add_argument('file', help = 'snapshot file to write')
+    buildParser.add_argument('--semesters', nargs = '*', default = [], help = 'further semesters like SS2021 or WS2021')
+    buildParser.add_argument('--strict', action = 'store_true', help = 'exit with 1 if any location failed')
+    infoParser = commands.add_parser('info', help = 'print the contents of a snapshot')
+    infoParser.add_argument('file', help = 'snapshot file to read')
+    arguments = parser.parse_args()
+
+    skill = loadSkillModule()
+    return {'build': build, 'info': info}[arguments.command](skill, arguments)
+
+if __name__ == '__main__':
+    sys.exit(main())